@@ -0,0 +1,336 @@
+'''
+Forms many beams at once over a block of samples.
+
+A beam is a row of complex weights, one per channel, and its output is the
+weighted sum of the channels. A `(beams, channels)` weight matrix applied to
+a `(channels, samples)` block is one matrix multiply, so hundreds of beams cost
+about as much as the BLAS call instead of hundreds of Python loops.
+
+`BeamBank.detect` goes one step further and runs the preamble detector on
+each tile while it is still in cache. Only the hits come out, so the memory
+used does not grow with the number of beams. `BeamBank.demod` checks their
+CRC and keeps each message once, which is what the battle scripts and
+bench.py count.
+
+The weight generators below cover the beams the battle scripts compare. All
+of them return rows that are applied as they are (`W @ X`), so for the
+steered beams the rows are already conjugated. Steering tables are kept in
+`STEERING_CACHE` by array geometry and angle grid so a sweep is built once
+rather than per block.
+'''
+import time
+import collections
+import numpy as np
+from modes import (
+    MODES_FRAME_SAMPLES, MODES_LONG_MSG_BYTES, detect_preambles_rows, slice_bits,
+    decode_msgs, dedup_hits
+)
+
+# The working set of one tile. About the size of a per-core L2 cache.
+BEAM_CACHE_BYTES = 1 << 20
+# The most beams in one tile.
+BEAM_TILE = 64
+
+class BeamBank:
+    """Applies a `(beams, channels)` weight matrix to blocks of samples in
+    complex64 tiles that fit in `cache_bytes`. The scratch space is kept
+    between blocks."""
+    def __init__(self, weights, cache_bytes: int = BEAM_CACHE_BYTES):
+        self.cache_bytes = int(cache_bytes)
+        self.tile = None
+        self.set_weights(weights)
+
+    def set_weights(self, weights):
+        self.weights = np.ascontiguousarray(weights, dtype=np.complex64)
+        assert self.weights.ndim == 2
+        self.beam_cnt, self.chan_cnt = self.weights.shape
+        self.beam_tile = min(self.beam_cnt, BEAM_TILE)
+        # A tile holds the channels and the complex beams for `samp_tile`
+        # samples plus their float32 magnitudes.
+        per_samp = 8 * self.chan_cnt + 12 * self.beam_tile
+        self.samp_tile = max(self.cache_bytes // per_samp, 256)
+
+    def _scratch(self):
+        # Room for a frame past the end of a tile so `detect` can finish
+        # the frames that start near the end of it.
+        shape = (self.beam_tile, self.samp_tile + MODES_FRAME_SAMPLES)
+        if self.tile is None or self.tile.shape != shape:
+            self.tile = np.empty(shape, np.complex64)
+            self.tile_mag = np.empty(shape, np.float32)
+        return self.tile
+
+    def tiles(self, samp_cnt: int):
+        """Yields `(b0, b1, s0, s1)` for the beam and sample ranges of each
+        tile in the order they are computed."""
+        for s0 in range(0, samp_cnt, self.samp_tile):
+            s1 = min(s0 + self.samp_tile, samp_cnt)
+            for b0 in range(0, self.beam_cnt, self.beam_tile):
+                b1 = min(b0 + self.beam_tile, self.beam_cnt)
+                yield b0, b1, s0, s1
+
+    def magnitudes(self, X, out=None):
+        """Returns the `(beams, samples)` float32 magnitudes of every beam
+        over the `(channels, samples)` block `X`."""
+        X = np.asarray(X, dtype=np.complex64)
+        assert X.shape[0] == self.chan_cnt
+
+        if out is None:
+            out = np.empty((self.beam_cnt, X.shape[1]), np.float32)
+
+        tile = self._scratch()
+        for b0, b1, s0, s1 in self.tiles(X.shape[1]):
+            y = tile[:b1 - b0, :s1 - s0]
+            np.matmul(self.weights[b0:b1], X[:, s0:s1], out=y)
+            np.abs(y, out=out[b0:b1, s0:s1])
+
+        return out
+
+    def detect(self, X, stages=None):
+        """Forms the beams over `X` one tile at a time and runs the
+        preamble detector and bit slicer on each tile. The magnitudes of all
+        the beams never exist at once.
+
+        Tiles overlap by a frame so every offset `demod_all` would test on
+        a beam is tested exactly once. Returns `(beams, indices, snrs, msgs)`
+        with `msgs` the `(K, 14)` sliced messages, ordered by index and
+        then beam.
+
+        If `stages` is a dict the seconds spent forming the beams, detecting
+        and slicing are added to its 'beamform', 'detect' and 'slice'.
+        """
+        X = np.asarray(X, dtype=np.complex64)
+        assert X.shape[0] == self.chan_cnt
+        samp_cnt = X.shape[1]
+
+        # The offsets that have a full frame after them, as `demod_all`.
+        offset_cnt = samp_cnt - MODES_FRAME_SAMPLES
+
+        tile = self._scratch()
+        hits = []
+        for b0, b1, s0, s1 in self.tiles(max(offset_cnt, 0)):
+            if stages is not None:
+                st = time.perf_counter()
+
+            # Offsets `[s0, s1)` need the samples up to a frame past `s1`.
+            e = s1 + MODES_FRAME_SAMPLES
+            y = tile[:b1 - b0, :e - s0]
+            mag = self.tile_mag[:b1 - b0, :e - s0]
+            np.matmul(self.weights[b0:b1], X[:, s0:e], out=y)
+            np.abs(y, out=mag)
+
+            if stages is not None:
+                et = time.perf_counter()
+                stages['beamform'] += et - st
+                st = et
+
+            rows, ndx, snr = detect_preambles_rows(mag, s1 - s0)
+
+            if stages is not None:
+                et = time.perf_counter()
+                stages['detect'] += et - st
+                st = et
+
+            msgs = slice_bits(mag, ndx, rows)
+
+            if stages is not None:
+                stages['slice'] += time.perf_counter() - st
+
+            hits.append((rows + b0, ndx + s0, snr, msgs))
+
+        if len(hits) == 0:
+            return (
+                np.zeros(0, np.intp), np.zeros(0, np.intp),
+                np.zeros(0, np.float32), np.zeros((0, MODES_LONG_MSG_BYTES), np.uint8)
+            )
+
+        beams, indices, snrs, msgs = (
+            np.concatenate(v) for v in zip(*hits)
+        )
+        order = np.lexsort((beams, indices))
+        return beams[order], indices[order], snrs[order], msgs[order]
+
+    def demod(self, X, table, stages=None):
+        """Runs `detect` over `X` and checks the CRC of the hits with the
+        bit error `table`. A message heard on several beams is kept once
+        with the beam that heard it best. Returns `(beams, indices, snrs,
+        msgs, long)` of those messages in order of index.
+
+        If `stages` is a dict the CRC time is added to its 'crc' as well.
+        """
+        beams, indices, snrs, msgs = self.detect(X, stages)
+
+        if stages is not None:
+            st = time.perf_counter()
+
+        ok, long = decode_msgs(msgs, table)
+        keep = dedup_hits(indices, snrs, ok, beams)
+
+        if stages is not None:
+            stages['crc'] += time.perf_counter() - st
+
+        return beams[keep], indices[keep], snrs[keep], msgs[keep], long[keep]
+
+def random_weights(beams: int, chan_cnt: int, rng=None):
+    """The first channel as is and every other channel at a uniformly random
+    phase, as in `a + b * np.exp(1j * theta)`."""
+    rng = np.random.default_rng() if rng is None else rng
+    theta = rng.uniform(-np.pi, np.pi, (int(beams), int(chan_cnt) - 1))
+    w = np.ones((int(beams), int(chan_cnt)), np.complex64)
+    w[:, 1:] = np.exp(1j * theta)
+    return w
+
+def random_amp_weights(beams: int, chan_cnt: int, rng=None):
+    """Like `random_weights` but every channel also gets a uniformly random
+    amplitude in [0, 1)."""
+    rng = np.random.default_rng() if rng is None else rng
+    w = random_weights(beams, chan_cnt, rng)
+    w *= rng.random((int(beams), int(chan_cnt)))
+    return w
+
+def steering_vectors(positions, thetas):
+    """The `(angles, channels)` steering vectors of an array with element
+    `positions` given as `(channels, 2)` x and y in wavelengths, for
+    plane waves arriving from each angle in `thetas` (radians from the y
+    axis, so broadside for elements along x)."""
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    thetas = np.asarray(thetas, dtype=np.float64)
+    direction = np.stack([np.sin(thetas), np.cos(thetas)], axis=1)
+    phase = 2.0 * np.pi * (direction @ positions.T)
+    return np.exp(1j * phase).astype(np.complex64)
+
+def ula_positions(chan_cnt: int, spacing: float):
+    """Element positions of a uniform linear array along x."""
+    positions = np.zeros((int(chan_cnt), 2))
+    positions[:, 0] = np.arange(int(chan_cnt)) * spacing
+    return positions
+
+class SteeringCache:
+    """Keeps the steering tables of the last `size` array geometries and
+    angle grids so each is only built once. The tables are shared and so
+    read only."""
+    def __init__(self, size: int = 8):
+        self.size = int(size)
+        self.tables = collections.OrderedDict()
+
+        # Counters.
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, positions, thetas, conj: bool = False):
+        """Returns the steering vectors for `positions` and `thetas`, or
+        their conjugates, the beam weights, if `conj` is set."""
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        thetas = np.asarray(thetas, dtype=np.float64)
+        key = (positions.tobytes(), thetas.tobytes(), bool(conj))
+
+        table = self.tables.get(key)
+        if table is not None:
+            self.tables.move_to_end(key)
+            self.hits += 1
+            return table
+
+        self.misses += 1
+        table = steering_vectors(positions, thetas)
+        if conj:
+            table = table.conj()
+        table.setflags(write=False)
+
+        self.tables[key] = table
+        if len(self.tables) > self.size:
+            self.tables.popitem(last=False)
+
+        return table
+
+STEERING_CACHE = SteeringCache()
+
+def ula_steering(thetas, chan_cnt: int, spacing: float):
+    """The `(angles, channels)` steering vectors of a uniform linear array
+    with `spacing` wavelengths between elements for each angle in `thetas`
+    (radians from broadside). They come from `STEERING_CACHE`."""
+    return STEERING_CACHE.get(ula_positions(chan_cnt, spacing), thetas)
+
+def ula_weights(thetas, chan_cnt: int, spacing: float):
+    """Steers a uniform linear array to each angle in `thetas`. These are
+    the conjugated steering vectors."""
+    return STEERING_CACHE.get(ula_positions(chan_cnt, spacing), thetas, conj=True)
+
+class MvdrScanner:
+    """MVDR weights for every steering vector in `steering` at once.
+
+    `update` estimates the covariance of a block and inverts it once for
+    all the angles. With `forget` set the covariance is an exponentially
+    weighted average over blocks instead, `forget` being the weight kept
+    by the old estimate.
+    """
+    def __init__(self, steering, forget: float = None):
+        self.steering = np.asarray(steering)
+        self.forget = forget
+        self.R = None
+        self.Rinv = None
+
+    def update(self, X):
+        X = np.asarray(X)
+        R = (X @ X.conj().T) / X.shape[1]
+        if self.forget is None or self.R is None:
+            self.R = R
+        else:
+            self.R = self.forget * self.R + (1.0 - self.forget) * R
+        self.Rinv = np.linalg.pinv(self.R)
+        return self
+
+    def weights(self):
+        """Returns the `(angles, channels)` rows, applied as they are."""
+        S = self.steering.astype(self.Rinv.dtype)
+        # `w = Rinv s / (s^H Rinv s)` for every row `s` of `S` at once.
+        RinvS = S @ self.Rinv.T
+        w = RinvS / np.sum(S.conj() * RinvS, axis=1, keepdims=True)
+        return w.conj().astype(np.complex64)
+
+def mvdr_weights(X, thetas, spacing: float):
+    """MVDR weights for a uniform linear array steered to each of `thetas`
+    using the covariance of the block `X`."""
+    X = np.asarray(X)
+    steering = ula_steering(thetas, X.shape[0], spacing)
+    return MvdrScanner(steering).update(X).weights()
+
+def lms_train(X, offsets, training, mu: float):
+    """Trains one LMS beamformer for each of `offsets` so the beam over the
+    samples of `X` starting there follows `training`. Every offset is
+    updated in lock-step, one training sample at a time, from zero weights.
+
+    Returns the `(K, channels)` rows, applied as they are like the other
+    generators.
+    """
+    X = np.asarray(X)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    w = np.zeros((len(offsets), X.shape[0]), np.complex128)
+    for i, want in enumerate(training):
+        r = X[:, offsets + i].T
+        y = np.sum(w.conj() * r, axis=1)
+        error = want - y
+        w += mu * np.conj(error)[:, None] * r
+    return w.conj()
+
+def apply_per_offset(X, weights, offsets, length: int, cache_bytes: int = BEAM_CACHE_BYTES):
+    """Applies row `k` of `weights` to the `length` samples of `X` starting
+    at `offsets[k]`. Returns the `(K, length)` magnitudes. The windows are
+    gathered in chunks that fit in `cache_bytes`."""
+    X = np.asarray(X)
+    weights = np.asarray(weights)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    length = int(length)
+
+    out = np.empty((len(offsets), length), X.real.dtype)
+    if len(offsets) == 0:
+        # `X` may be shorter than `length`.
+        return out
+
+    windows = np.lib.stride_tricks.sliding_window_view(X, length, axis=1)
+
+    chunk = max(int(cache_bytes) // (X.shape[0] * length * X.itemsize), 1)
+    for k0 in range(0, len(offsets), chunk):
+        k1 = min(k0 + chunk, len(offsets))
+        y = np.einsum('kc,ckn->kn', weights[k0:k1], windows[:, offsets[k0:k1]])
+        np.abs(y, out=out[k0:k1])
+
+    return out
@@ -0,0 +1,254 @@
+'''
+Benchmarks the beam search strategies (see strategies.py) over recordings.
+
+Every strategy runs over the same blocks of each recording with its own
+generator from `--seed`, so two runs of the same build give the same counts.
+The report is JSON, one entry per recording and strategy, with:
+
+    messages            CRC-valid messages, one per position however many
+                        beams heard it
+    distinct_messages   different CRC-valid payloads
+    cpu_s, wall_s       process CPU and wall seconds spent on the strategy
+    msgs_per_cpu_s      messages per CPU second
+    block_wall_*        wall seconds per block against `block_budget_s`,
+                        the time the radio takes to fill a block
+    realtime_fraction   mean block wall time over the budget, which must
+                        stay under 1 to keep up with the radio
+    peak_rss_kb         peak resident memory of the process that ran the
+                        strategy, one process per strategy
+    stages              wall seconds in weights / beamform / detect /
+                        slice / crc
+
+The adaptive strategy is the `--search` strategy sized every block to use
+`--target` of the block budget, with the beams that found messages tried
+first. `beams_per_block` is its mean including the first blocks where it
+is still finding the budget, and `beams_last_block` is where it ended up.
+
+The blocks go through `BeamBank.demod` as in the battle scripts, so the
+beamform, detect and slice times are summed over its tiles.
+'''
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from sampleformat import FORMAT_SC16_Q11, FORMAT_SC8_Q7
+from recording import Recording
+from beamform import BeamBank, apply_per_offset
+from strategies import (
+    STRATEGIES, LmsStrategy, AdaptiveStrategy, BeamBudget, SEED, BUDGET_TARGET
+)
+from modes import (
+    MODES_FRAME_SAMPLES, MODES_PREAMBLE_SAMPLES, MODES_LONG_MSG_SAMPLES,
+    MODES_SHORT_MSG_BYTES,
+    detect_preambles_rows, slice_bits, decode_msgs, dedup_hits,
+    load_error_table
+)
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows.
+    resource = None
+
+# The preamble the LMS beams are trained on, as in battle2.py.
+LMS_TRAINING = np.exp(1j) * np.array(
+    [1, 0, 1, 0, 0, 0, 0, 1, 0, 1, 0, 0, 0, 0, 0, 0]
+)
+LMS_MU = 0.5e-5
+
+STAGES = ('weights', 'beamform', 'detect', 'slice', 'crc')
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def make_strategy(name: str, args, block_seconds: float):
+    thetas = np.linspace(-np.pi * 0.5, np.pi * 0.5, args.angles)
+    if name in ('random', 'random-amp', 'golden'):
+        return STRATEGIES[name](args.beams)
+    if name in ('ula', 'mvdr'):
+        return STRATEGIES[name](thetas, args.spacing)
+    if name == 'lms':
+        return STRATEGIES[name](LMS_TRAINING, LMS_MU)
+    if name == 'adaptive':
+        budget = BeamBudget(block_seconds, args.target, args.beams)
+        return STRATEGIES[name](make_strategy(args.search, args, block_seconds), budget)
+    raise Exception(f'unknown strategy {name}')
+
+def run_block(strategy, bank, rng, X, table, stages):
+    """Runs one block through `strategy` the way the battle scripts do. Adds
+    the time of each stage to `stages` and returns the beam count and the
+    `(beams, indices, msgs, long)` of the messages found."""
+    if isinstance(strategy, AdaptiveStrategy):
+        # The same loop as the battle scripts. It times the block itself
+        # for the budget and tracks the beams that found messages.
+        rows, ndx, _, msgs, long = strategy.run(X, rng, table, stages)
+        return len(strategy.last), rows, ndx, msgs, long
+
+    st = time.perf_counter()
+    W = strategy.weights(X, rng)
+    stages['weights'] += time.perf_counter() - st
+
+    if isinstance(strategy, LmsStrategy):
+        # One beam per offset, applied to the frame after its preamble
+        # with the training in front, as battle2.py does.
+        st = time.perf_counter()
+        offsets = strategy.offsets
+        mag = np.empty((len(offsets), MODES_FRAME_SAMPLES))
+        mag[:, :MODES_PREAMBLE_SAMPLES] = np.abs(strategy.training)
+        mag[:, MODES_PREAMBLE_SAMPLES:] = apply_per_offset(
+            X, W, offsets + MODES_PREAMBLE_SAMPLES, MODES_LONG_MSG_SAMPLES
+        )
+        et = time.perf_counter()
+        stages['beamform'] += et - st
+
+        st = et
+        rows, _, snr = detect_preambles_rows(mag, 1)
+        et = time.perf_counter()
+        stages['detect'] += et - st
+
+        st = et
+        msgs = slice_bits(mag, np.zeros(len(rows), np.intp), rows)
+        stages['slice'] += time.perf_counter() - st
+
+        # The rows are the offsets.
+        ndx = offsets[rows]
+        rows = np.zeros(len(rows), np.intp)
+
+        st = time.perf_counter()
+        ok, long = decode_msgs(msgs, table)
+        keep = dedup_hits(ndx, snr, ok, rows)
+        stages['crc'] += time.perf_counter() - st
+
+        return len(W), rows[keep], ndx[keep], msgs[keep], long[keep]
+
+    # Fused per tile, the stages are timed inside.
+    bank.set_weights(W)
+    rows, ndx, _, msgs, long = bank.demod(X, table, stages)
+    return len(W), rows, ndx, msgs, long
+
+def open_recording(path: str, args):
+    sample_format = FORMAT_SC8_Q7 if args.sc8 else FORMAT_SC16_Q11
+    return Recording(path, chan_cnt=args.chan_cnt, sample_format=sample_format)
+
+def run_strategy(path: str, name: str, args):
+    """Runs one strategy over the recording at `path` and returns its
+    entry of the report. `main` runs it in a process of its own."""
+    rec = open_recording(path, args)
+    table = load_error_table()
+    budget = args.block_samps / rec.sample_rate
+    strategy = make_strategy(name, args, budget)
+    rng = np.random.default_rng(args.seed)
+    # Kept across blocks for its scratch space.
+    bank = BeamBank(np.ones((1, rec.chan_cnt)))
+
+    stages = {stage: 0.0 for stage in STAGES}
+    block_walls = []
+    beams = 0
+    beam_cnt = 0
+    messages = 0
+    distinct = set()
+
+    cpu_st = time.process_time()
+    wall_st = time.perf_counter()
+    for block, (start, X) in enumerate(rec.windows(args.block_samps)):
+        if args.max_blocks is not None and block >= args.max_blocks:
+            break
+
+        st = time.perf_counter()
+        beam_cnt, _, indices, msgs, long = run_block(strategy, bank, rng, X, table, stages)
+        block_walls.append(time.perf_counter() - st)
+
+        beams += beam_cnt
+        messages += len(indices)
+        for msg, is_long in zip(msgs.tolist(), long.tolist()):
+            distinct.add(bytes(msg if is_long else msg[:MODES_SHORT_MSG_BYTES]))
+    cpu = time.process_time() - cpu_st
+    wall = time.perf_counter() - wall_st
+
+    blocks = len(block_walls)
+    block_walls = np.array(block_walls) if blocks > 0 else np.zeros(1)
+
+    return {
+        'strategy': name,
+        'blocks': blocks,
+        'beams_per_block': beams / max(blocks, 1),
+        'beams_last_block': beam_cnt,
+        'messages': messages,
+        'distinct_messages': len(distinct),
+        'cpu_s': cpu,
+        'wall_s': wall,
+        'msgs_per_cpu_s': messages / cpu if cpu > 0 else None,
+        'block_wall_mean_s': float(block_walls.mean()),
+        'block_wall_p99_s': float(np.percentile(block_walls, 99)),
+        'block_wall_max_s': float(block_walls.max()),
+        'realtime_fraction': float(block_walls.mean() / budget),
+        'blocks_over_budget': int(np.count_nonzero(block_walls > budget)),
+        'peak_rss_kb': peak_rss_kb(),
+        'stages': stages,
+    }
+
+def main(args):
+    # Built once here so the children only map it.
+    load_error_table()
+    # A fresh process for each strategy so the peak memory is its own and
+    # not the highest of the ones before it.
+    ctx = multiprocessing.get_context('spawn')
+
+    report = {
+        'seed': args.seed,
+        'block_samps': args.block_samps,
+        'numpy': np.__version__,
+        'recordings': [],
+    }
+
+    for path in args.file:
+        rec = open_recording(path, args)
+        entry = {
+            'file': path,
+            'chan_cnt': rec.chan_cnt,
+            'sample_rate': rec.sample_rate,
+            'seconds': len(rec) / rec.sample_rate,
+            'block_budget_s': args.block_samps / rec.sample_rate,
+            'strategies': [],
+        }
+        for name in args.strategies:
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_strategy, (path, name, args))
+            print(
+                path, name, 'messages', result['messages'],
+                'per cpu second', result['msgs_per_cpu_s'],
+                'real time', result['realtime_fraction'],
+                file=sys.stderr
+            )
+            entry['strategies'].append(result)
+        report['recordings'].append(entry)
+
+    out = json.dumps(report, indent=2)
+    if args.output is None:
+        print(out)
+    else:
+        with open(args.output, 'w') as fd:
+            fd.write(out)
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(
+        description='Benchmarks the beam search strategies over recordings and reports JSON.'
+    )
+    ap.add_argument('--file', type=str, nargs='+', required=True, help='The recordings to run over.')
+    ap.add_argument('--chan-cnt', type=int, default=None, help='The number of streams in a recording without a header.')
+    ap.add_argument('--sc8', action='store_true', help='The samples of a recording without a header are 8-bit SC8_Q7.')
+    ap.add_argument('--strategies', type=str, nargs='+', default=sorted(STRATEGIES), choices=sorted(STRATEGIES), help='The strategies to run.')
+    ap.add_argument('--beams', type=int, default=600, help='The beams per block of the random and golden strategies, and the first block of the adaptive one.')
+    ap.add_argument('--search', type=str, default='golden', choices=['random', 'random-amp', 'golden'], help='The strategy the adaptive one sizes to the budget.')
+    ap.add_argument('--target', type=float, default=BUDGET_TARGET, help='The fraction of the time the radio takes to fill a block the adaptive strategy aims to use.')
+    ap.add_argument('--angles', type=int, default=600, help='The angles of the ULA and MVDR strategies.')
+    ap.add_argument('--spacing', type=float, default=0.5, help='The ULA element spacing in wavelengths.')
+    ap.add_argument('--block-samps', type=int, default=MODES_LONG_MSG_SAMPLES * 16, help='The samples per channel in a block.')
+    ap.add_argument('--max-blocks', type=int, default=None, help='Stop after this many blocks of each recording.')
+    ap.add_argument('--seed', type=int, default=SEED, help='The seed of every strategy.')
+    ap.add_argument('--output', type=str, default=None, help='Write the JSON here instead of to stdout.')
+    main(ap.parse_args())
@@ -1,19 +1,132 @@
 import bladerf
 import numpy as np
 import numpy.typing as npt
+from sampleformat import (
+    FORMAT_SC16_Q11, FORMAT_DTYPE, FORMAT_SCALE, format_from_samp_size
+)
+
+# The samples from the blade are only 12-bit and are scaled into [-1, 1).
+SC16_Q11_SCALE = FORMAT_SCALE[FORMAT_SC16_Q11]
+
+def deinterleave(
+        buf,
+        chan_cnt: int,
+        out: npt.NDArray[np.complexfloating] = None,
+        samp_size: int = 4
+        ) -> npt.NDArray[np.complexfloating]:
+    """Converts interleaved samples into a `(chan_cnt, samps)` complex array in
+    a single pass. `samp_size` is 4 for SC16_Q11 and 2 for SC8_Q7.
+
+    The card delivers samples as:
+
+        AABB..  (or AABBCCDD.. for multiple boards)
+        IQIQ..
+
+    `out` may be a preallocated complex64 or complex128 array of shape
+    `(chan_cnt, samps)`. If it is `None` a complex64 array is allocated.
+    """
+    chan_cnt = int(chan_cnt)
+    fmt = format_from_samp_size(samp_size)
+
+    # View the raw bytes as (samps, channels, IQ) without copying.
+    sbuf = np.frombuffer(buf, dtype=FORMAT_DTYPE[fmt]).reshape(-1, chan_cnt, 2)
+
+    if out is None:
+        out = np.empty((chan_cnt, sbuf.shape[0]), np.complex64)
+
+    assert out.shape == (chan_cnt, sbuf.shape[0])
+
+    # A complex array is laid out as (real, imag) pairs so its float view has
+    # the same (channels, samps, IQ) shape as the transposed source. The
+    # multiply scales and converts straight into `out`.
+    fout = out.view(out.real.dtype).reshape(chan_cnt, sbuf.shape[0], 2)
+    np.multiply(
+        sbuf.transpose(1, 0, 2),
+        fout.dtype.type(1.0 / FORMAT_SCALE[fmt]),
+        out=fout,
+        casting='unsafe'
+    )
+
+    return out
+
+def deinterleave_sc16(
+        buf,
+        chan_cnt: int,
+        out: npt.NDArray[np.complexfloating] = None
+        ) -> npt.NDArray[np.complexfloating]:
+    """`deinterleave` for SC16_Q11 samples."""
+    return deinterleave(buf, chan_cnt, out, 4)
+
+def reinterleave_boards(
+        chunks,
+        out: npt.NDArray[np.integer] = None,
+        board_chan_cnt: int = 2,
+        samp_size: int = 4
+        ) -> npt.NDArray[np.integer]:
+    """Merges blocks from K boards into one interleaved stream.
+
+    Each chunk holds `board_chan_cnt` interleaved channels from one board
+    (`AABB..`). The result holds all of the channels in board order, for
+    example with two boards:
+
+        AABBCCDDAABBCCDD...
+        IQIQIQIQIQIQIQIQ...
+
+    `out` may be a preallocated array which is reused between calls. It is
+    int16 for SC16_Q11 (`samp_size` 4) and int8 for SC8_Q7 (`samp_size` 2).
+    """
+    board_cnt = len(chunks)
+    frame = board_chan_cnt * 2
+    dtype = FORMAT_DTYPE[format_from_samp_size(samp_size)]
+
+    views = [np.frombuffer(chunk, dtype=dtype).reshape(-1, frame) for chunk in chunks]
+    samps = views[0].shape[0]
+
+    if out is None:
+        out = np.empty(samps * board_cnt * frame, dtype)
+
+    np.stack(views, axis=1, out=out.reshape(samps, board_cnt, frame))
+
+    return out
+
+class SampleRing:
+    """A fixed number of preallocated receive buffers handed out in round-robin
+    order. The card writes straight into a slot so nothing is allocated per read.
+
+    A slot is reused after `len(slots)` more reads so any view into it must be
+    consumed (sent, copied, or converted) before then.
+    """
+    def __init__(self, slot_count: int, slot_bytes: int):
+        self.slot_bytes = int(slot_bytes)
+        self.slots = [bytearray(self.slot_bytes) for _ in range(int(slot_count))]
+        self.index = 0
+
+    def next_slot(self) -> bytearray:
+        slot = self.slots[self.index]
+        self.index = (self.index + 1) % len(self.slots)
+        return slot
 
 class BladeRFAndNumpy(bladerf.BladeRF):
     """A helper class that assists in converting the raw samples from the BladeRF
-    card into a Numpy array of floating point numbers. *It currently does not support
-    8-bit samples but could easily be modified to do so.*
+    card into a Numpy array of floating point numbers. The `samp_size` argument
+    selects the format the stream was configured with: 4 for SC16_Q11 and 2 for
+    SC8_Q7.
+
+    Reads go into a `SampleRing` of `ring_slots` buffers which is (re)built the
+    first time a given block size is requested.
     """
-    def sample_as_null(
+    def __init__(self, *args, ring_slots: int = 4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ring_slots = int(ring_slots)
+        self.ring = None
+
+    def _sample_into_ring(
             self,
             samps: int,
             chan_cnt: int,
             samp_size: int,
-            trash_samps: int = 1000
-            ):
+            trash_samps: int
+            ) -> memoryview:
         samps = int(samps)
         samp_size = int(samp_size)
         chan_cnt = int(chan_cnt)
@@ -22,7 +135,11 @@ class BladeRFAndNumpy(bladerf.BladeRF):
         debug_tail = 8
         total_bytes = \
             (trash_samps + samps) * (samp_size * chan_cnt) + debug_tail
-        buf = bytes(total_bytes)
+
+        if self.ring is None or self.ring.slot_bytes != total_bytes:
+            self.ring = SampleRing(self.ring_slots, total_bytes)
+
+        buf = self.ring.next_slot()
 
         self.sync_rx(
             buf,
@@ -30,86 +147,143 @@ class BladeRFAndNumpy(bladerf.BladeRF):
             timeout_ms=5000
         )
 
-        if chan_cnt == 2:
-            return
-        elif chan_cnt == 1:
-            return
-        else:
-            raise Exception('unexpected channel count')
+        # The tail is never written by the card. If it is not zero the card
+        # wrote more than we asked for.
+        assert (buf[-debug_tail:] == b'\x00' * debug_tail)
 
-    def sample_as_bytes(
+        return memoryview(buf)[trash_samps * (samp_size * chan_cnt):-debug_tail]
+
+    def sample_as_view(
             self,
             samps: int,
             chan_cnt: int,
             samp_size: int,
             trash_samps: int = 1000
+            ) -> memoryview:
+        """Like `sample_as_bytes` but returns a `memoryview` into a ring slot
+        instead of a copy. The view is only valid until the ring wraps around.
+        """
+        return self._sample_into_ring(samps, chan_cnt, samp_size, trash_samps)
+
+    @staticmethod
+    def stream_block_bytes(samps: int, chan_cnt: int, samp_size: int) -> int:
+        """The size of one `sample_stream` slot including the debug tail."""
+        debug_tail = 8
+        return int(samps) * (int(samp_size) * int(chan_cnt)) + debug_tail
+
+    def sample_stream(
+            self,
+            samps: int,
+            chan_cnt: int,
+            samp_size: int,
+            trash_samps: int = 1000,
+            next_slot = None
             ):
+        """Yields gap-free blocks from a stream that was configured with a
+        `*_META` format (for example `Format.SC16_Q11_META`).
+
+        The first `trash_samps` samples are thrown away once when the stream
+        is primed and never again. Each block is the tuple
+        `(buf, timestamp, gap)` where `buf` is a `memoryview` into the receive
+        ring, `timestamp` is the hardware timestamp of the first sample, and
+        `gap` is the number of samples per channel that the card dropped since
+        the previous block (zero unless there was an overrun). A block is only
+        shorter than `samps` when an overrun cut it short.
+
+        `next_slot` replaces the internal ring as the source of buffers. It
+        must return a `bytearray` of `stream_block_bytes(...)` bytes.
+        """
         samps = int(samps)
         samp_size = int(samp_size)
         chan_cnt = int(chan_cnt)
         trash_samps = int(trash_samps)
 
         debug_tail = 8
-        total_bytes = \
-            (trash_samps + samps) * (samp_size * chan_cnt) + debug_tail
-        buf = bytes(total_bytes)
+        total_bytes = self.stream_block_bytes(samps, chan_cnt, samp_size)
+
+        if next_slot is None:
+            if self.ring is None or self.ring.slot_bytes != total_bytes:
+                self.ring = SampleRing(self.ring_slots, total_bytes)
+            next_slot = self.ring.next_slot
+
+        if trash_samps > 0:
+            trash = bytearray(trash_samps * samp_size * chan_cnt)
+            _, actual_count, timestamp = self.sync_rx_with_metadata(
+                trash,
+                trash_samps * chan_cnt,
+                meta_flags=bladerf._bladerf.META_FLAG_RX_NOW,
+                timeout_ms=5000
+            )
+            expected = timestamp + actual_count // chan_cnt
+        else:
+            expected = None
 
-        self.sync_rx(
-            buf, 
-            (trash_samps + samps) * chan_cnt,
-            timeout_ms=5000
-        )
+        while True:
+            buf = next_slot()
+            view = memoryview(buf)
+            filled = 0
+            gap = 0
+            first_timestamp = None
 
-        assert (buf[-debug_tail:] == b'\x00' * debug_tail)
+            while filled < samps:
+                status, actual_count, timestamp = self.sync_rx_with_metadata(
+                    view[filled * samp_size * chan_cnt:-debug_tail],
+                    (samps - filled) * chan_cnt,
+                    meta_flags=bladerf._bladerf.META_FLAG_RX_NOW,
+                    timeout_ms=5000
+                )
 
-        buf = buf[trash_samps * (samp_size * chan_cnt):-debug_tail]
+                if expected is not None and timestamp != expected:
+                    gap += timestamp - expected
 
-        return buf
+                if first_timestamp is None:
+                    first_timestamp = timestamp
 
-    def sample_as_f64(
+                filled += actual_count // chan_cnt
+                expected = timestamp + actual_count // chan_cnt
+
+                # An overrun ends a read early and the next sample is not
+                # contiguous with this one. End the block here so every block
+                # is one unbroken run that starts at its timestamp. The lost
+                # samples are reported as the `gap` of the next block.
+                if status & bladerf._bladerf.META_STATUS_OVERRUN:
+                    break
+
+            assert (buf[-debug_tail:] == b'\x00' * debug_tail)
+
+            yield view[:filled * samp_size * chan_cnt], first_timestamp, gap
+
+    def sample_as_null(
             self,
             samps: int,
             chan_cnt: int,
             samp_size: int,
             trash_samps: int = 1000
             ):
-        samps = int(samps)
-        samp_size = int(samp_size)
         chan_cnt = int(chan_cnt)
-        trash_samps = int(trash_samps)
-
-        debug_tail = 8
-        total_bytes = \
-            (trash_samps + samps) * (samp_size * chan_cnt) + debug_tail
-        buf = bytes(total_bytes)
-
-        self.sync_rx(
-            buf, 
-            (trash_samps + samps) * chan_cnt,
-            timeout_ms=5000
-        )
-
-        assert (buf[-debug_tail:] == b'\x00' * debug_tail)
 
-        buf = buf[trash_samps * (samp_size * chan_cnt):-debug_tail]
-
-        sbuf = np.ndarray((len(buf) // 2,), buffer=buf, dtype=np.int16)
-        del buf
-
-        sbuf = sbuf.astype(np.float64) / 2049
+        self._sample_into_ring(samps, chan_cnt, samp_size, trash_samps)
 
         if chan_cnt == 2:
-            b0 = sbuf[0::2][0::2] + 1j * sbuf[1::2][0::2]
-            b1 = sbuf[0::2][1::2] + 1j * sbuf[1::2][1::2]
-            return b0, b1
+            return
         elif chan_cnt == 1:
-            b0 = sbuf[0::2] + 1j * sbuf[1::2]
-            assert len(b0) == samps
-            return b0
+            return
         else:
             raise Exception('unexpected channel count')
 
-    def sample_as_f32(
+    def sample_as_bytes(
+            self,
+            samps: int,
+            chan_cnt: int,
+            samp_size: int,
+            trash_samps: int = 1000
+            ):
+        buf = self._sample_into_ring(samps, chan_cnt, samp_size, trash_samps)
+
+        # The caller owns the result so it must be copied out of the ring.
+        return bytes(buf)
+
+    def sample_as_f64(
             self,
             samps: int,
             chan_cnt: int,
@@ -117,39 +291,41 @@ class BladeRFAndNumpy(bladerf.BladeRF):
             trash_samps: int = 1000
             ):
         samps = int(samps)
-        samp_size = int(samp_size)
         chan_cnt = int(chan_cnt)
-        trash_samps = int(trash_samps)
 
-        debug_tail = 8
-        total_bytes = \
-            (trash_samps + samps) * (samp_size * chan_cnt) + debug_tail
-        buf = bytes(total_bytes)
+        buf = self._sample_into_ring(samps, chan_cnt, samp_size, trash_samps)
 
-        self.sync_rx(
-            buf, 
-            (trash_samps + samps) * chan_cnt,
-            timeout_ms=5000
+        out = deinterleave(
+            buf, chan_cnt, np.empty((chan_cnt, samps), np.complex128), samp_size
         )
 
-        assert (buf[-debug_tail:] == b'\x00' * debug_tail)
+        if chan_cnt == 1:
+            return out[0]
+        return tuple(out)
+
+    def sample_as_f32(
+            self,
+            samps: int,
+            chan_cnt: int,
+            samp_size: int,
+            trash_samps: int = 1000,
+            out: npt.NDArray[np.complex64] = None
+            ):
+        """Returns complex64 channels. If `out` is given it must be a
+        `(chan_cnt, samps)` complex64 array and it is filled in place."""
+        samps = int(samps)
+        chan_cnt = int(chan_cnt)
 
-        buf = buf[trash_samps * (samp_size * chan_cnt):-debug_tail]
+        buf = self._sample_into_ring(samps, chan_cnt, samp_size, trash_samps)
 
-        sbuf = np.ndarray((len(buf) // 2,), buffer=buf, dtype=np.int16)
-        del buf
+        if out is None:
+            out = np.empty((chan_cnt, samps), np.complex64)
 
-        sbuf = sbuf.astype(np.float32) / 2049
+        deinterleave(buf, chan_cnt, out, samp_size)
 
-        if chan_cnt == 2:
-            b0 = sbuf[0::2][0::2] + 1j * sbuf[1::2][0::2]
-            b1 = sbuf[0::2][1::2] + 1j * sbuf[1::2][1::2]
-            return b0, b1
-        elif chan_cnt == 1:
-            b0 = sbuf[0::2] + 1j * sbuf[1::2]
-            return b0
-        else:
-            raise Exception('unexpected channel count')
+        if chan_cnt == 1:
+            return out[0]
+        return tuple(out)
 
     def sample_as_f64_with_meta(
             self,
@@ -159,6 +335,10 @@ class BladeRFAndNumpy(bladerf.BladeRF):
             trash_samps: int,
             when_timestamp: int,
             ):
+        """Like `sample_as_f64` but for a stream configured with a `*_META`
+        format. Returns `(channels, timestamp)` where `timestamp` is the
+        hardware timestamp of the first returned sample so blocks from
+        different boards can be matched up."""
         samps = int(samps)
         samp_size = int(samp_size)
         chan_cnt = int(chan_cnt)
@@ -167,35 +347,29 @@ class BladeRFAndNumpy(bladerf.BladeRF):
         debug_tail = 8
         total_bytes = \
             (trash_samps + samps) * (samp_size * chan_cnt) + debug_tail
-        buf = bytes(total_bytes)
-
-        print('meta_timestamp', when_timestamp, self.get_timestamp(bladerf.Direction.RX))
-        print('samps', samps, 'chan_cnt', chan_cnt, 'trash_samps', trash_samps)
-        print('(trash_samps + samps) * chan_cnt', (trash_samps + samps) * chan_cnt)
+        buf = bytearray(total_bytes)
 
         status, actual_count, timestamp = self.sync_rx_with_metadata(
             buf, 
             (trash_samps + samps) * chan_cnt,
-            meta_flags = 1 << 31,
+            meta_flags = bladerf._bladerf.META_FLAG_RX_NOW,
             meta_timestamp = when_timestamp,
             timeout_ms=20000
         )
 
         assert (buf[-debug_tail:] == b'\x00' * debug_tail)
 
-        buf = buf[trash_samps * (samp_size * chan_cnt):]
+        if actual_count != (trash_samps + samps) * chan_cnt:
+            raise Exception('overrun while reading samples with metadata')
 
-        sbuf = np.ndarray((len(buf) // 2,), buffer=buf, dtype=np.int16)
-        del buf
+        buf = memoryview(buf)[trash_samps * (samp_size * chan_cnt):-debug_tail]
 
-        sbuf = sbuf.astype(np.float64) / 2049
+        out = deinterleave(
+            buf, chan_cnt, np.empty((chan_cnt, samps), np.complex128), samp_size
+        )
 
-        if chan_cnt == 2:
-            b0 = sbuf[0::2][0::2] + 1j * sbuf[1::2][0::2]
-            b1 = sbuf[0::2][1::2] + 1j * sbuf[1::2][1::2]
-            return b0, b1
-        elif chan_cnt == 1:
-            b0 = sbuf[0::2] + 1j * sbuf[1::2]
-            return b0
-        else:
-            raise Exception('unexpected channel count')
+        timestamp += trash_samps
+
+        if chan_cnt == 1:
+            return out[0], timestamp
+        return tuple(out), timestamp
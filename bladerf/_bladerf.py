@@ -468,6 +468,10 @@ BLADERF_SERIAL_LENGTH = 33
 TRIGGER_ROLE_MASTER = libbladeRF.BLADERF_TRIGGER_ROLE_MASTER
 TRIGGER_ROLE_SLAVE = libbladeRF.BLADERF_TRIGGER_ROLE_SLAVE
 
+# struct bladerf_metadata flags and status bits (libbladeRF.h)
+META_FLAG_RX_NOW = 1 << 31
+META_STATUS_OVERRUN = 1 << 0
+
 ###############################################################################
 
 
@@ -896,6 +900,31 @@ class BladeRF:
                                          timeout_ms or 0)
         _check_error(ret)
 
+    def sync_rx_with_metadata(self, buf, num_samples, meta_flags=0,
+                              meta_timestamp=0, timeout_ms=None):
+        """Receive with a `struct bladerf_metadata`. The stream must be
+        configured with a `*_META` format. Returns the tuple
+        `(status, actual_count, timestamp)` filled in by libbladeRF."""
+        meta = ffi.new("struct bladerf_metadata *")
+        meta.flags = meta_flags
+        meta.timestamp = meta_timestamp
+        ret = libbladeRF.bladerf_sync_rx(self.dev[0],
+                                         ffi.from_buffer(buf),
+                                         num_samples,
+                                         meta,
+                                         timeout_ms or 0)
+        _check_error(ret)
+        return meta.status, meta.actual_count, meta.timestamp
+
+    def get_timestamp(self, direction):
+        if isinstance(direction, Direction):
+            direction = direction.value
+        timestamp = ffi.new("bladerf_timestamp *")
+        ret = libbladeRF.bladerf_get_timestamp(self.dev[0], direction,
+                                               timestamp)
+        _check_error(ret)
+        return timestamp[0]
+
     # FPGA/Firmware Loading/Flashing
 
     def load_fpga(self, image_path):
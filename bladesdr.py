@@ -1,16 +1,31 @@
-import socket
+import time
 import argparse
+import threading
 import bladerf
 from bladeandnumpy import BladeRFAndNumpy
+from samplepipe import CapturePipeline, FanoutServer
+from framing import FrameWriter
+from sampleformat import (
+    FORMAT_SC16_Q11, FORMAT_SC8_Q7, FORMAT_SAMP_SIZE, STREAM_SC8_FLAG
+)
 
 def main(args):
     sps = 2000000
 
+    # SC8_Q7 halves the bytes per sample on USB and on the socket.
+    if args.sc8:
+        sample_format = FORMAT_SC8_Q7
+        dev_format = bladerf._bladerf.Format.SC8_Q7_META
+    else:
+        sample_format = FORMAT_SC16_Q11
+        dev_format = bladerf._bladerf.Format.SC16_Q11_META
+    samp_size = FORMAT_SAMP_SIZE[sample_format]
+
     dev = BladeRFAndNumpy(f'libusb:serial={args.serial}')
 
     dev.sync_config(
         bladerf._bladerf.ChannelLayout.RX_X2,
-        bladerf._bladerf.Format.SC16_Q11,
+        dev_format,
         num_buffers=16,
         buffer_size=1024 * 32,
         num_transfers=8,
@@ -29,29 +44,79 @@ def main(args):
 
     dev.set_frequency(0, 1090000000 + args.freq_offset)
 
-    tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    tcp_socket.bind(('localhost', 7878))
-    tcp_socket.listen(1)
+    # Every client gets the number of streams as a byte followed by the
+    # same samples. A slow client only hurts itself. The framed stream sends
+    # a zero instead and puts a header in front of every block.
+    if args.framed:
+        writer = FrameWriter(2, sps, sample_format)
+        handshake = bytes([0])
+    else:
+        writer = None
+        if args.sc8:
+            handshake = bytes([2 | STREAM_SC8_FLAG])
+        else:
+            handshake = bytes([2])
+
+    server = FanoutServer(
+        ('localhost', 7878),
+        handshake,
+        depth=args.client_queue_depth,
+        policy=args.slow_client
+    )
+
+    # One thread owns `sync_rx` and this thread hands the blocks to the
+    # clients. The stream is primed once so clients see one continuous run
+    # of samples instead of a hole at the start of every block.
+    pipe = CapturePipeline(
+        dev.stream_block_bytes(buffer_samps, 2, samp_size),
+        depth=args.queue_depth
+    )
 
-    while True:
-        connection, client = tcp_socket.accept()
-        print('got client', client)
+    capture_thread = threading.Thread(
+        target=pipe.capture,
+        args=(dev.sample_stream(buffer_samps, 2, samp_size, next_slot=pipe.acquire),),
+        daemon=True
+    )
+    capture_thread.start()
 
-        # Send the number of streams as a byte.
-        connection.sendall(bytes([2]))
+    stat_start = time.time()
+    try:
+        while True:
+            block = pipe.get()
+            if block is None:
+                break
+            buf, timestamp, gap = block
+            if gap != 0:
+                print('overrun: dropped', gap, 'samples before', timestamp)
+            if writer is not None:
+                server.publish(buf, writer.header(len(buf), timestamp, gap))
+            else:
+                server.publish(buf)
+            pipe.release(buf)
 
-        # Clear the buffer incase it is dirty.
-        dev.sample_as_bytes(buffer_samps, 2, 4, 0)
-        try:
-            while True:
-                connection.sendall(dev.sample_as_bytes(buffer_samps, 2, 4, 0))
-        finally:
-            connection.close()
+            if time.time() - stat_start > 5:
+                stat_start = time.time()
+                print(
+                    'captured', pipe.captured,
+                    'queue-depth', pipe.depth(),
+                    'max-queue-depth', pipe.max_depth,
+                    'dropped', pipe.dropped
+                )
+                for client, queued, sent, dropped in server.stats():
+                    print('client', client, 'queued', queued, 'sent', sent, 'dropped', dropped)
+    finally:
+        pipe.close()
+        capture_thread.join()
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser(
-        description='Listens on 1090MHZ. Writes samples to connected client.'
+        description='Listens on 1090MHZ. Writes samples to all connected clients.'
     )
     ap.add_argument('--serial', type=str, required=True, help='The first few unambigious letters of the serial for the card to use.')
     ap.add_argument('--freq-offset', type=float, required=True, help='Any offset for correction otherwise zero.')
+    ap.add_argument('--queue-depth', type=int, default=8, help='The number of sample blocks buffered between the capture and send threads.')
+    ap.add_argument('--client-queue-depth', type=int, default=8, help='The number of sample blocks buffered for each client.')
+    ap.add_argument('--sc8', action='store_true', help='Capture 8-bit SC8_Q7 samples instead of 16-bit SC16_Q11. main.rs only reads 16-bit samples.')
+    ap.add_argument('--framed', action='store_true', help='Send the framed stream (see framing.py) instead of the raw stream that main.rs reads.')
+    ap.add_argument('--slow-client', type=str, default='drop-oldest', choices=['drop-oldest', 'disconnect'], help='What to do with a client that falls behind.')
     main(ap.parse_args())
\ No newline at end of file
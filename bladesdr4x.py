@@ -1,145 +1,123 @@
 '''
-This program configures two BladeSDR boards to operate in tandem to provide 
-4 RX streams.
+This program configures two or more BladeSDR boards to operate in tandem to
+provide 2 RX streams per board. Two boards give 4 RX streams.
 '''
-import queue
 import time
-import socket
 import argparse
-import bladerf
-import numpy as np
-import threading
-from bladeandnumpy import BladeRFAndNumpy
+from multiboard import MultiBoardCapture
+from samplepipe import FanoutServer
+from framing import FrameWriter
+from recording import RecordingWriter
+from sampleformat import (
+    FORMAT_SC16_Q11, FORMAT_SC8_Q7, FORMAT_SAMP_SIZE, STREAM_SC8_FLAG
+)
 
 def main(args):
     sps = 2000000
 
-    print('opening master')
-    dev_master = BladeRFAndNumpy(f'libusb:serial={args.serial_master}')
-    print('opening slave')
-    dev_slave = BladeRFAndNumpy(f'libusb:serial={args.serial_slave}')
-
     buffer_samps = 16 * 1024 * 32
 
-    print('connecting clocks of master and slave')
-    dev_master.set_clock_output(True)
-    time.sleep(0.5)
-    dev_slave.set_clock_select(bladerf._bladerf.ClockSelect.External)
-
-    print('creating master trigger')
-    trig_master = dev_master.trigger_init(0, bladerf._bladerf.TriggerSignal.Trigger_J51_1)
-    trig_master.role = bladerf._bladerf.TRIGGER_ROLE_MASTER
-    print('creating slave trigger')
-    trig_slave = dev_slave.trigger_init(0, bladerf._bladerf.TriggerSignal.Trigger_J51_1)
-    trig_slave.role = bladerf._bladerf.TRIGGER_ROLE_SLAVE
-
-    dev_master.trigger_arm(trig_master, 1, 0, 0)
-    dev_slave.trigger_arm(trig_slave, 1, 0, 0)
-
-    for dev in [dev_master, dev_slave]:
-        print('configuring', dev)
-        dev.sync_config(
-            bladerf._bladerf.ChannelLayout.RX_X2,
-            bladerf._bladerf.Format.SC16_Q11,
-            num_buffers=16,
-            buffer_size=1024 * 32,
-            num_transfers=8,
-            stream_timeout=40000
-        )
-
-        for ch in [0, 2]:
-            dev.set_gain_mode(ch, bladerf._bladerf.GainMode.Manual)
-            dev.set_bias_tee(ch, False)
-            dev.set_bandwidth(ch, sps)
-            dev.set_sample_rate(ch, sps)
-            dev.set_gain(ch, 60)
-            dev.enable_module(ch, True)
-        print('setting frequency')
-        dev.set_frequency(0, 1090000000)
+    # SC8_Q7 halves the bytes per sample on USB and on the socket.
+    sample_format = FORMAT_SC8_Q7 if args.sc8 else FORMAT_SC16_Q11
 
-    def reader_thread(dev, q):
-        print('thread running', dev)
-        while True:
-            chunk = dev.sample_as_bytes(buffer_samps, 2, 4, 0)
-            q.put(chunk)
-    
-    qm = queue.Queue()
-    qs = queue.Queue()
-
-    master_thread = threading.Thread(
-        target = reader_thread, args=(dev_master, qm), daemon=True
-    )
-    slave_thread = threading.Thread(
-        target = reader_thread, args=(dev_slave, qs), daemon=True
+    capture = MultiBoardCapture(
+        args.serials,
+        sps=sps,
+        buffer_samps=buffer_samps,
+        queue_depth=args.queue_depth,
+        samp_size=FORMAT_SAMP_SIZE[sample_format]
     )
 
-    print('...about to fire the trigger (connect client now!)')
-    time.sleep(1)
+    # The framed stream sends a zero instead of the stream count and puts a
+    # header in front of every block.
+    if args.framed:
+        writer = FrameWriter(capture.chan_cnt, sps, sample_format)
+        handshake = bytes([0])
+    else:
+        writer = None
+        if args.sc8:
+            handshake = bytes([capture.chan_cnt | STREAM_SC8_FLAG])
+        else:
+            handshake = bytes([capture.chan_cnt])
 
     if args.file_output is None:
-        tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        tcp_socket.bind(('localhost', 7878))
-        tcp_socket.listen(1)
-        connection, client = tcp_socket.accept()
+        # Every client gets the handshake byte followed by the same samples.
+        # Clients may come and go while the boards stream.
+        server = FanoutServer(
+            ('localhost', 7878),
+            handshake,
+            depth=args.client_queue_depth,
+            policy=args.slow_client
+        )
     else:
-        connection = None
-        client = None
-        fd = open(args.file_output, 'ab')
-
-    master_thread.start()
-    slave_thread.start()    
+        # A recording is raw samples behind a small header. See recording.py.
+        server = None
+        recorder = RecordingWriter(
+            args.file_output,
+            capture.chan_cnt,
+            sps,
+            capture.frequency,
+            sample_format,
+            overwrite=args.overwrite
+        )
 
-    dev_master.trigger_fire(trig_master)
-    print('trigger fired')    
+    # After the output is open so a bad path fails before the boards are
+    # touched.
+    capture.configure()
 
-    # Send the number of streams as a byte.
-    if connection is not None:
-        connection.sendall(bytes([4]))
+    print('...about to fire the trigger')
+    capture.start()
 
-    while True:
+    stat_start = time.time()
+    try:
         st = time.time()
-        # I think we should have enough time to service both buffers
-        # from the same thread, reinterleave, and then grab the next
-        # chunks before the internal buffer overruns.
-        #chunk0 = dev_master.sample_as_bytes(buffer_samps, 2, 4, 0)
-        #chunk1 = dev_slave.sample_as_bytes(buffer_samps, 2, 4, 0)
-        chunk0 = qm.get()
-        chunk1 = qs.get()
-        #
-        # Reinterleave the samples so we have a format like:
-        #
-        # AABBCCDDAABBCCDD...
-        # IQIQIQIQIQIQIQIQ...
-        #
-        # That will be 4 channels in total from two streams of 2 channels
-        # each.
-        #
-        chunk0 = np.ndarray(int(len(chunk0) // 2), np.int16, chunk0)
-        chunk1 = np.ndarray(int(len(chunk1) // 2), np.int16, chunk1)
-        chunk2 = np.zeros(chunk0.shape[0] * 2, np.int16)
-        chunk2[0::8] = chunk0[0::4]
-        chunk2[1::8] = chunk0[1::4]
-        chunk2[2::8] = chunk0[2::4]
-        chunk2[3::8] = chunk0[3::4]
-        chunk2[4::8] = chunk1[0::4]
-        chunk2[5::8] = chunk1[1::4]
-        chunk2[6::8] = chunk1[2::4]
-        chunk2[7::8] = chunk1[3::4]
-
-        et = time.time() - st
-        print(et * sps, buffer_samps)
-
-        if connection is not None:
-            connection.sendall(chunk2.tobytes())
-        else:
-            fd.write(chunk2.tobytes())
-            
+        for merged, timestamp, gap in capture.blocks():
+            et = time.time() - st
+
+            if gap != 0:
+                print('gap of', gap, 'samples at', timestamp)
+
+            # The aligner counts from the trigger. The recordings and the
+            # frames carry the hardware timestamp of the master, as the other
+            # frontends do.
+            hw_timestamp = capture.aligner.bases[0] + timestamp
+
+            if server is None:
+                # Zero fills the samples a resync skipped.
+                recorder.write(merged, hw_timestamp)
+            elif writer is not None:
+                server.publish(merged, writer.header(merged.nbytes, hw_timestamp, gap))
+            else:
+                server.publish(merged)
+
+            if time.time() - stat_start > 5:
+                stat_start = time.time()
+                aligner = capture.aligner
+                print(
+                    'merged', aligner.merged,
+                    'dropped', aligner.dropped,
+                    'padded', aligner.padded,
+                    'resyncs', aligner.resyncs,
+                    'skew', aligner.skew,
+                    'max-skew', aligner.max_skew,
+                    'wait-time', et * sps, 'buffer-samps', buffer_samps
+                )
+            st = time.time()
+    finally:
+        capture.close()
+        if server is None:
+            recorder.close()
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser(
-        description='Listens on 1090MHZ. Writes samples to connected client or a file.'
+        description='Listens on 1090MHZ. Writes samples to all connected clients or a file.'
     )
-    ap.add_argument('--serial-master', type=str, required=True, help='The first few unambigious letters of the serial for the card to use.')
-    ap.add_argument('--serial-slave', type=str, required=True, help='The first few unambigious letters of the serial for the card to use.')
-    ap.add_argument('--file-output', type=str, default=None, help='A path to write the samples to a file.')
-    main(ap.parse_args())
\ No newline at end of file
+    ap.add_argument('--serials', type=str, nargs='+', required=True, help='The first few unambigious letters of the serial for each card. The first is the master and each card feeds its CLKOUT to the CLKIN of the next.')
+    ap.add_argument('--file-output', type=str, default=None, help='A path to write a recording (see recording.py) to instead of serving the samples.')
+    ap.add_argument('--overwrite', action='store_true', help='Replace the --file-output recording if it already exists.')
+    ap.add_argument('--queue-depth', type=int, default=8, help='The number of sample blocks buffered for each board.')
+    ap.add_argument('--client-queue-depth', type=int, default=8, help='The number of sample blocks buffered for each client.')
+    ap.add_argument('--sc8', action='store_true', help='Capture 8-bit SC8_Q7 samples instead of 16-bit SC16_Q11. main.rs only reads 16-bit samples.')
+    ap.add_argument('--framed', action='store_true', help='Send the framed stream (see framing.py) instead of the raw stream that main.rs reads.')
+    ap.add_argument('--slow-client', type=str, default='drop-oldest', choices=['drop-oldest', 'disconnect'], help='What to do with a client that falls behind.')
+    main(ap.parse_args())
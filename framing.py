@@ -0,0 +1,241 @@
+'''
+The framed sample stream protocol and a reference reader for it.
+
+The legacy stream served on port 7878 is one byte holding the stream count
+followed by raw interleaved samples forever. It is still the default because
+`main.rs` reads it. The byte has `STREAM_SC8_FLAG` set when the samples are
+SC8_Q7 instead of SC16_Q11.
+
+The framed stream starts with a single zero byte, which a legacy reader sees as
+zero streams. `main.rs` refuses it and says to run the frontend without
+`--framed`. After that it is a sequence of frames. Each frame is
+a fixed header followed by `payload_bytes` of interleaved samples:
+
+    4s   magic `RSAF`
+    u8   version
+    u8   flags (FLAG_GAP when samples were lost right before this frame)
+    u8   channel count
+    u8   sample format (FORMAT_SC16_Q11 or FORMAT_SC8_Q7)
+    u32  sample rate
+    u64  sequence number, one per frame
+    u64  hardware timestamp of the first sample
+    u32  samples per channel lost right before this frame
+    u32  payload bytes
+
+Everything is little endian. A reader that loses its place scans forward for
+the magic, so it can resynchronize without reconnecting.
+'''
+import struct
+import socket
+import argparse
+import collections
+from sampleformat import (
+    FORMAT_SC16_Q11, FORMAT_SC8_Q7, FORMAT_SAMP_SIZE, STREAM_SC8_FLAG
+)
+
+FRAME_MAGIC = b'RSAF'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<4sBBBBIQQII')
+
+FLAG_GAP = 1 << 0
+
+FrameHeader = collections.namedtuple(
+    'FrameHeader',
+    [
+        'version', 'flags', 'chan_cnt', 'sample_format', 'sample_rate',
+        'sequence', 'timestamp', 'gap', 'payload_bytes'
+    ]
+)
+
+class FrameWriter:
+    """Builds frame headers for one stream. It numbers the frames and works
+    out the gap from the timestamps so dropped blocks anywhere upstream show
+    up downstream."""
+    def __init__(
+            self,
+            chan_cnt: int,
+            sample_rate: int,
+            sample_format: int = FORMAT_SC16_Q11
+            ):
+        self.chan_cnt = int(chan_cnt)
+        self.sample_rate = int(sample_rate)
+        self.sample_format = int(sample_format)
+        self.samp_size = FORMAT_SAMP_SIZE[self.sample_format]
+        self.sequence = 0
+        self.expected = None
+
+    def header(self, payload_bytes: int, timestamp: int, gap: int = 0) -> bytes:
+        payload_bytes = int(payload_bytes)
+        timestamp = int(timestamp)
+        gap = int(gap)
+
+        if self.expected is not None and timestamp != self.expected:
+            gap = max(gap, timestamp - self.expected)
+
+        self.expected = timestamp + payload_bytes // (self.samp_size * self.chan_cnt)
+
+        flags = FLAG_GAP if gap != 0 else 0
+
+        hdr = FRAME_HEADER.pack(
+            FRAME_MAGIC,
+            FRAME_VERSION,
+            flags,
+            self.chan_cnt,
+            self.sample_format,
+            self.sample_rate,
+            self.sequence,
+            timestamp,
+            gap,
+            payload_bytes
+        )
+
+        self.sequence += 1
+
+        return hdr
+
+def _read_exact(fd, size: int):
+    """Reads exactly `size` bytes or returns `None` at the end of the stream.
+    `fd` may be a file or a socket."""
+    out = bytearray()
+    read = getattr(fd, 'recv', None) or fd.read
+    while len(out) < size:
+        chunk = read(size - len(out))
+        if len(chunk) == 0:
+            return None
+        out += chunk
+    return out
+
+class FrameReader:
+    """A reference reader for both the framed and the legacy stream.
+
+    Iterating yields `(header, payload)`. For a legacy stream the headers are
+    made up from the stream count and a running sample count since the legacy
+    stream carries nothing else.
+    """
+    def __init__(
+            self,
+            fd,
+            legacy_chunk_samps: int = 16 * 1024,
+            sample_rate: int = 2000000
+            ):
+        self.fd = fd
+        self.legacy_chunk_samps = int(legacy_chunk_samps)
+        self.sample_rate = int(sample_rate)
+
+        # Counters.
+        self.frames = 0
+        self.gaps = 0
+        self.resyncs = 0
+        self.lost_frames = 0
+
+        first = _read_exact(fd, 1)
+        if first is None:
+            raise Exception('sample stream closed before the handshake')
+
+        self.legacy = first[0] != 0
+        if self.legacy:
+            self.chan_cnt = first[0] & ~STREAM_SC8_FLAG
+            if first[0] & STREAM_SC8_FLAG:
+                self.sample_format = FORMAT_SC8_Q7
+            else:
+                self.sample_format = FORMAT_SC16_Q11
+        else:
+            self.chan_cnt = None
+            self.sample_format = None
+
+    def _sync(self):
+        """Reads up to and including the next frame magic."""
+        window = bytearray()
+        while True:
+            byte = _read_exact(self.fd, 1)
+            if byte is None:
+                return False
+            window += byte
+            if window[-len(FRAME_MAGIC):] == FRAME_MAGIC:
+                if len(window) > len(FRAME_MAGIC):
+                    self.resyncs += 1
+                return True
+
+    def _legacy_frames(self):
+        samp_size = FORMAT_SAMP_SIZE[self.sample_format]
+        chunk_bytes = self.legacy_chunk_samps * samp_size * self.chan_cnt
+        sequence = 0
+        timestamp = 0
+        while True:
+            payload = _read_exact(self.fd, chunk_bytes)
+            if payload is None:
+                return
+            yield FrameHeader(
+                0, 0, self.chan_cnt, self.sample_format, self.sample_rate,
+                sequence, timestamp, 0, len(payload)
+            ), payload
+            sequence += 1
+            timestamp += self.legacy_chunk_samps
+
+    def __iter__(self):
+        if self.legacy:
+            yield from self._legacy_frames()
+            return
+
+        expected_sequence = None
+
+        while True:
+            if not self._sync():
+                return
+
+            rest = _read_exact(self.fd, FRAME_HEADER.size - len(FRAME_MAGIC))
+            if rest is None:
+                return
+
+            header = FrameHeader(*FRAME_HEADER.unpack(FRAME_MAGIC + rest)[1:])
+
+            if header.version != FRAME_VERSION:
+                # Most likely the magic showed up inside sample data.
+                self.resyncs += 1
+                continue
+
+            payload = _read_exact(self.fd, header.payload_bytes)
+            if payload is None:
+                return
+
+            if expected_sequence is not None and header.sequence != expected_sequence:
+                self.lost_frames += header.sequence - expected_sequence
+            expected_sequence = header.sequence + 1
+
+            if header.flags & FLAG_GAP:
+                self.gaps += 1
+
+            self.frames += 1
+
+            yield header, payload
+
+def main(args):
+    connection = socket.create_connection((args.host, args.port))
+    reader = FrameReader(connection)
+
+    if reader.legacy:
+        print('legacy stream with', reader.chan_cnt, 'streams')
+    else:
+        print('framed stream')
+
+    for header, payload in reader:
+        if header.flags & FLAG_GAP:
+            print('gap of', header.gap, 'samples at', header.timestamp)
+        if header.sequence % 100 == 0:
+            print(
+                'sequence', header.sequence,
+                'timestamp', header.timestamp,
+                'channels', header.chan_cnt,
+                'frames', reader.frames,
+                'gaps', reader.gaps,
+                'lost-frames', reader.lost_frames,
+                'resyncs', reader.resyncs
+            )
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(
+        description='Reads the sample stream and prints what it sees.'
+    )
+    ap.add_argument('--host', type=str, default='localhost', help='The host serving the sample stream.')
+    ap.add_argument('--port', type=int, default=7878, help='The port serving the sample stream.')
+    main(ap.parse_args())
@@ -0,0 +1,407 @@
+'''
+Mode S demodulation and CRC with NumPy.
+
+These work on a whole magnitude vector (or a batch of candidates) at once and
+give exactly the same answers as the scalar `demod` in `test.py`.
+
+The CRC has a byte-at-a-time path for single messages and a batch path that
+computes the syndromes of a `(K, 14)` array of messages in one call.
+
+Single and double bit errors are corrected with a sorted table of syndromes
+that is cached on disk and memory mapped. See `load_error_table`.
+'''
+import os
+import numpy as np
+
+MODES_PREAMBLE_US = 8
+MODES_PREAMBLE_SAMPLES = MODES_PREAMBLE_US * 2
+MODES_LONG_MSG_BYTES = 14
+MODES_SHORT_MSG_BYTES = 7
+MODES_LONG_MSG_BITS = MODES_LONG_MSG_BYTES * 8
+MODES_SHORT_MSG_BITS = MODES_SHORT_MSG_BYTES * 8
+MODES_LONG_MSG_SAMPLES = MODES_LONG_MSG_BITS * 2
+MODES_SHORT_MSG_SAMPLES = MODES_SHORT_MSG_BITS * 2
+MODES_FRAME_SAMPLES = MODES_PREAMBLE_SAMPLES + MODES_LONG_MSG_SAMPLES
+
+MODES_CHECKSUM_TABLE = [
+    0x3935ea, 0x1c9af5, 0xf1b77e, 0x78dbbf, 0xc397db, 0x9e31e9, 0xb0e2f0, 0x587178,
+    0x2c38bc, 0x161c5e, 0x0b0e2f, 0xfa7d13, 0x82c48d, 0xbe9842, 0x5f4c21, 0xd05c14,
+    0x682e0a, 0x341705, 0xe5f186, 0x72f8c3, 0xc68665, 0x9cb936, 0x4e5c9b, 0xd8d449,
+    0x939020, 0x49c810, 0x24e408, 0x127204, 0x093902, 0x049c81, 0xfdb444, 0x7eda22,
+    0x3f6d11, 0xe04c8c, 0x702646, 0x381323, 0xe3f395, 0x8e03ce, 0x4701e7, 0xdc7af7,
+    0x91c77f, 0xb719bb, 0xa476d9, 0xadc168, 0x56e0b4, 0x2b705a, 0x15b82d, 0xf52612,
+    0x7a9309, 0xc2b380, 0x6159c0, 0x30ace0, 0x185670, 0x0c2b38, 0x06159c, 0x030ace,
+    0x018567, 0xff38b7, 0x80665f, 0xbfc92b, 0xa01e91, 0xaff54c, 0x57faa6, 0x2bfd53,
+    0xea04ad, 0x8af852, 0x457c29, 0xdd4410, 0x6ea208, 0x375104, 0x1ba882, 0x0dd441,
+    0xf91024, 0x7c8812, 0x3e4409, 0xe0d800, 0x706c00, 0x383600, 0x1c1b00, 0x0e0d80,
+    0x0706c0, 0x038360, 0x01c1b0, 0x00e0d8, 0x00706c, 0x003836, 0x001c1b, 0xfff409,
+    0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000,
+    0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000,
+    0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000
+]
+
+# The CRC generator without its x^24 term. It is also the table entry for the
+# last data bit of a long message.
+MODES_GENERATOR_POLY = 0xfff409
+
+def _crc_byte_table():
+    """The usual table for running the CRC a byte at a time."""
+    table = []
+    for byte in range(256):
+        crc = byte << 16
+        for _ in range(8):
+            if crc & 0x800000:
+                crc = (crc << 1) ^ MODES_GENERATOR_POLY
+            else:
+                crc = crc << 1
+        table.append(crc & 0xffffff)
+    return table
+
+def _crc_position_table():
+    """`table[p, v]` is the CRC contribution of byte value `v` at byte `p` of
+    a long message. Byte `p` of a short message is byte `p + 7` of a long
+    one because the short table starts 56 bits in."""
+    bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)
+    checksum = np.array(MODES_CHECKSUM_TABLE, dtype=np.uint32)
+    table = np.zeros((MODES_LONG_MSG_BYTES - 3, 256), dtype=np.uint32)
+    for p in range(table.shape[0]):
+        table[p] = np.bitwise_xor.reduce(
+            np.where(bits, checksum[p * 8:p * 8 + 8], 0).astype(np.uint32),
+            axis=1
+        )
+    return table
+
+MODES_CRC_BYTE_TABLE = _crc_byte_table()
+MODES_CRC_POSITION_TABLE = _crc_position_table()
+
+# The bit error table covers one and two bit errors anywhere after the first
+# five bits (the downlink format) of a long message.
+ERROR_TABLE_FIRST_BIT = 5
+# Next to this module so it is found from any working directory.
+ERROR_TABLE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'modes_error_table.npy'
+)
+# Marks the second position of a single bit error.
+ERROR_TABLE_NO_BIT = 0xff
+
+def _preamble_test(mag, count: int):
+    """The preamble test of `demod` along the last axis of `mag`. Returns
+    the `np.nonzero` style indices of the offsets that pass and their
+    SNRs."""
+    # `p[k][..., x]` is `p[k]` of the scalar test at offset `x`.
+    p = [mag[..., k:k + count] for k in range(MODES_PREAMBLE_SAMPLES - 1)]
+
+    # The cheap comparisons first over every offset. Only the few offsets
+    # that pass them are tested against the threshold.
+    valid = p[0] > p[1]
+    valid &= p[1] < p[2]
+    valid &= p[2] > p[3]
+    valid &= p[3] < p[0]
+    valid &= p[4] < p[0]
+    valid &= p[5] < p[0]
+    valid &= p[6] < p[0]
+    valid &= p[7] > p[8]
+    valid &= p[8] < p[9]
+    valid &= p[9] > p[6]
+
+    # Cheaper than `np.nonzero` for more than one dimension.
+    ndx = np.unravel_index(np.flatnonzero(valid), valid.shape)
+    q = [v[ndx] for v in p]
+
+    high = (q[0] + q[2] + q[7] + q[9]) / 6
+
+    # Written as the negation of the scalar rejects so the answer is the
+    # same for every input the scalar code accepts.
+    keep = ~(q[4] >= high)
+    keep &= ~(q[5] >= high)
+    keep &= ~(q[11] > high)
+    keep &= ~(q[12] > high)
+    keep &= ~(q[13] > high)
+    keep &= ~(q[14] > high)
+
+    snr = (q[0] - q[1]) + (q[2] - q[3]) + (q[7] - q[6]) + (q[9] - q[8])
+
+    return tuple(n[keep] for n in ndx), snr[keep]
+
+def detect_preambles(mag, count: int = None):
+    """Runs the preamble test of `demod` at every offset of `mag` at once.
+
+    `count` is the number of offsets to test. It defaults to the offsets
+    `demod_all` tests, which is every offset with a full frame after it,
+    less one.
+
+    Returns `(indices, snrs)` of the offsets that pass, in increasing order.
+    """
+    mag = np.asarray(mag)
+
+    if count is None:
+        count = len(mag) - MODES_FRAME_SAMPLES
+    count = max(int(count), 0)
+
+    (ndx,), snr = _preamble_test(mag, count)
+
+    return ndx, snr
+
+def detect_preambles_rows(mag, count: int = None):
+    """`detect_preambles` for every row of the 2-D `mag` at once. Returns
+    `(rows, indices, snrs)` ordered by row and then index."""
+    mag = np.asarray(mag)
+    assert mag.ndim == 2
+
+    if count is None:
+        count = mag.shape[1] - MODES_FRAME_SAMPLES
+    count = max(int(count), 0)
+
+    (rows, ndx), snr = _preamble_test(mag, count)
+
+    return rows, ndx, snr
+
+def slice_bits(mag, indices, rows=None):
+    """Slices the 112 bits of the long frame that starts at each of
+    `indices` the way `demod` does. A bit is one when the first sample of
+    its pair is the larger. If `rows` is given `mag` is 2-D and each frame
+    is taken from its row.
+
+    Returns a `(K, 14)` uint8 array with one message per row. A short
+    message is the first seven bytes of its row.
+    """
+    mag = np.asarray(mag)
+    indices = np.asarray(indices, dtype=np.intp)
+
+    if len(indices) == 0:
+        # `mag` may be too short to hold even one frame.
+        return np.zeros((0, MODES_LONG_MSG_BYTES), np.uint8)
+
+    # A view of every frame payload. Indexing it gathers `(K, 224)`.
+    windows = np.lib.stride_tricks.sliding_window_view(mag, MODES_LONG_MSG_SAMPLES, axis=-1)
+    if rows is None:
+        payload = windows[indices + MODES_PREAMBLE_SAMPLES]
+    else:
+        payload = windows[rows, indices + MODES_PREAMBLE_SAMPLES]
+
+    bits = payload[:, 0::2] > payload[:, 1::2]
+
+    return np.packbits(bits, axis=1)
+
+def modes_compute_crc(msg):
+    """The CRC over everything but the parity field of a long or short
+    message, a byte at a time."""
+    assert len(msg) == MODES_LONG_MSG_BYTES or len(msg) == MODES_SHORT_MSG_BYTES
+
+    crc = 0
+    for byte in msg[:-3]:
+        crc = ((crc << 8) & 0xffffff) ^ MODES_CRC_BYTE_TABLE[(crc >> 16) ^ byte]
+    return crc
+
+def modes_checksum(msg):
+    """The syndrome of one message. Zero means the parity checks out."""
+    crc = modes_compute_crc(msg)
+    rem = (msg[-3] << 16) | (msg[-2] << 8) | msg[-1]
+    return (crc ^ rem) & 0xffffff
+
+def is_long_msg(msgs):
+    """Which rows of a `(K, 14)` message array are long messages, decided
+    by the downlink format the same way `demod_all` does."""
+    return ((msgs[:, 0] >> 3) & 0x10) == 0x10
+
+def modes_checksums(msgs, long=None):
+    """The syndromes of a `(K, 14)` uint8 array of messages as uint32.
+
+    `long` says which rows are long messages. It defaults to
+    `is_long_msg`. A short message is the first seven bytes of its row.
+    """
+    msgs = np.asarray(msgs, dtype=np.uint8)
+    if long is None:
+        long = is_long_msg(msgs)
+
+    table = MODES_CRC_POSITION_TABLE
+    m = msgs.astype(np.intp)
+
+    crc_long = np.zeros(msgs.shape[0], dtype=np.uint32)
+    for p in range(MODES_LONG_MSG_BYTES - 3):
+        crc_long ^= table[p][m[:, p]]
+
+    crc_short = np.zeros(msgs.shape[0], dtype=np.uint32)
+    for p in range(MODES_SHORT_MSG_BYTES - 3):
+        crc_short ^= table[p + MODES_SHORT_MSG_BYTES][m[:, p]]
+
+    rem = msgs.astype(np.uint32)
+    rem_long = (rem[:, 11] << 16) | (rem[:, 12] << 8) | rem[:, 13]
+    rem_short = (rem[:, 4] << 16) | (rem[:, 5] << 8) | rem[:, 6]
+
+    return np.where(long, crc_long ^ rem_long, crc_short ^ rem_short)
+
+def _bit_syndromes():
+    """The syndrome of a long message with only bit `i` set, for each `i`.
+    The CRC is linear so any error pattern is the xor of these."""
+    checksum = MODES_CHECKSUM_TABLE[:MODES_LONG_MSG_BITS - 24]
+    parity = [1 << (23 - k) for k in range(24)]
+    return np.array(checksum + parity, dtype=np.uint32)
+
+def build_error_table():
+    """Builds the bit error table as a `(2, N)` uint32 array. Row 0 holds
+    the syndromes in increasing order. Row 1 holds the bit positions that
+    cause each one packed as `first | second << 8`, with
+    `ERROR_TABLE_NO_BIT` as the second position of a single bit error.
+    """
+    single = _bit_syndromes()
+
+    first = np.arange(ERROR_TABLE_FIRST_BIT, MODES_LONG_MSG_BITS)
+    i, j = np.triu_indices(len(first), 1)
+    i = first[i]
+    j = first[j]
+
+    syndromes = np.concatenate([single[first], single[i] ^ single[j]])
+    bits = np.concatenate([
+        first | (ERROR_TABLE_NO_BIT << 8),
+        i | (j << 8)
+    ]).astype(np.uint32)
+
+    order = np.argsort(syndromes, kind='stable')
+    syndromes = syndromes[order]
+    bits = bits[order]
+
+    if np.any(syndromes[1:] == syndromes[:-1]):
+        raise Exception('the bit error table has colliding syndromes')
+
+    return np.stack([syndromes, bits])
+
+def load_error_table(path: str = ERROR_TABLE_PATH):
+    """Memory maps the bit error table at `path`, building and saving it
+    first if the file is missing or not the expected shape. If it can not
+    be saved the table is built and kept in memory every time."""
+    n = MODES_LONG_MSG_BITS - ERROR_TABLE_FIRST_BIT
+    shape = (2, n + n * (n - 1) // 2)
+
+    if os.path.exists(path):
+        table = np.load(path, mmap_mode='r')
+        if table.shape == shape and table.dtype == np.uint32:
+            return table
+
+    table = build_error_table()
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'wb') as fd:
+            np.save(fd, table)
+        os.replace(tmp, path)
+    except OSError:
+        return table
+
+    return np.load(path, mmap_mode='r')
+
+def _lookup_errors(table, syndromes):
+    """Returns `(found, first, second)` for an array of syndromes."""
+    syndromes = np.asarray(syndromes, dtype=np.uint32)
+    at = np.searchsorted(table[0], syndromes)
+    at = np.minimum(at, table.shape[1] - 1)
+    found = table[0][at] == syndromes
+    bits = table[1][at]
+    return found, (bits & 0xff).astype(np.intp), (bits >> 8).astype(np.intp)
+
+def fix_bit_errors(msg, table):
+    """Corrects one or two bit errors in the list `msg` in place using
+    `table` from `load_error_table`. Returns the number of bits fixed or
+    zero if the errors can not be fixed."""
+    syndrome = modes_checksum(msg)
+    found, first, second = _lookup_errors(table, [syndrome])
+
+    if not found[0]:
+        return 0
+
+    pei = [int(first[0])]
+    if second[0] != ERROR_TABLE_NO_BIT:
+        pei.append(int(second[0]))
+
+    offset = MODES_LONG_MSG_BITS - len(msg) * 8
+
+    for _bitpos in pei:
+        bitpos = _bitpos - offset
+        if bitpos < 0:
+            return 0
+
+    for _bitpos in pei:
+        bitpos = _bitpos - offset
+        msg[bitpos >> 3] = msg[bitpos >> 3] ^ (1 << (7 - (bitpos & 7)))
+
+    return len(pei)
+
+def fix_bit_errors_batch(msgs, syndromes, long, table):
+    """Corrects one or two bit errors in every row of the `(K, 14)` uint8
+    array `msgs` whose syndrome is not zero, in place.
+
+    Returns the number of bits fixed in each row. It is zero for rows that
+    are already valid and for rows that can not be fixed, exactly as
+    `fix_bit_errors` would decide.
+    """
+    syndromes = np.asarray(syndromes, dtype=np.uint32)
+    found, first, second = _lookup_errors(table, syndromes)
+
+    found &= syndromes != 0
+
+    # A short message starts 56 bits into the long message positions.
+    offset = np.where(long, 0, MODES_LONG_MSG_BITS - MODES_SHORT_MSG_BITS)
+    first = first - offset
+    second = second - offset
+    single = second == ERROR_TABLE_NO_BIT - offset
+
+    # The second position is always after the first so only the first can
+    # land before a short message.
+    fix = found & (first >= 0)
+
+    rows = np.flatnonzero(fix)
+    bit = first[rows]
+    msgs[rows, bit >> 3] ^= (1 << (7 - (bit & 7))).astype(np.uint8)
+
+    rows = np.flatnonzero(fix & ~single)
+    bit = second[rows]
+    msgs[rows, bit >> 3] ^= (1 << (7 - (bit & 7))).astype(np.uint8)
+
+    return np.where(fix, np.where(single, 1, 2), 0).astype(np.uint8)
+
+def decode_msgs(msgs, table):
+    """Checks the CRC of a `(K, 14)` batch of sliced messages and fixes
+    what `table` can fix, in place. Returns `(ok, long)` where `ok` marks
+    the rows that are valid now and `long` the rows that are long
+    messages."""
+    long = is_long_msg(msgs)
+    syndromes = modes_checksums(msgs, long)
+    fixed = fix_bit_errors_batch(msgs, syndromes, long, table)
+    return (syndromes == 0) | (fixed > 0), long
+
+def dedup_hits(indices, snrs, ok=None, beams=None, tolerance: int = 1):
+    """Picks one hit per message from the hits of many beams.
+
+    Hits whose sample indices are within `tolerance` of each other (chained)
+    are the same message and the one with the best SNR wins. Only hits
+    marked in `ok`, usually the CRC-valid ones, take part. Ties go to the
+    lower beam.
+
+    Returns the positions of the winners in the hit arrays, in order of
+    sample index. `beams[winners]` says which beam won each message.
+    """
+    indices = np.asarray(indices)
+    snrs = np.asarray(snrs)
+    if beams is None:
+        beams = np.zeros(len(indices), np.intp)
+    beams = np.asarray(beams)
+
+    if ok is None:
+        live = np.arange(len(indices))
+    else:
+        live = np.flatnonzero(ok)
+
+    if len(live) == 0:
+        return live
+
+    # In sample order a new message starts wherever the gap to the previous
+    # hit is more than the tolerance.
+    live = live[np.argsort(indices[live], kind='stable')]
+    group = np.concatenate([
+        [0], np.cumsum(np.diff(indices[live]) > tolerance)
+    ])
+
+    # Best SNR first within each message and `np.unique` takes the first.
+    order = np.lexsort((beams[live], -snrs[live], group))
+    _, first = np.unique(group[order], return_index=True)
+
+    return live[order[first]]
@@ -0,0 +1,314 @@
+'''
+Captures from any number of BladeSDR boards that share one clock and one
+trigger so they behave as a single array of `2 * len(serials)` coherent RX
+streams.
+
+The boards are chained clock out to clock in in the order given. The first
+board is the master. It drives the trigger on J51[1] which every board has
+wired together. See the README section "Two BladeSDR Boards".
+'''
+import time
+import threading
+import bladerf
+import numpy as np
+from bladeandnumpy import BladeRFAndNumpy, reinterleave_boards
+from samplepipe import CapturePipeline
+from sampleformat import FORMAT_DTYPE, format_from_samp_size
+
+class BlockAligner:
+    """Merges timestamped blocks from several boards into one interleaved
+    stream of fixed size blocks.
+
+    Each pipe yields `(buf, timestamp, gap)` blocks from one board. The first
+    block of every board defines that board's origin because the boards are
+    started by the same trigger. After that the samples are placed by their
+    timestamp alone so a dropped, late, or short block on one board can never
+    shift the boards against each other. Samples that a board does not have
+    are filled with zeros and counted in the gap marker of the merged block.
+    If every board jumps ahead by more than `max_pad_samps` the merger
+    resynchronizes by skipping ahead instead of padding.
+
+    `skew` is the spread in samples between the oldest unmerged samples of
+    the boards when the last block was merged. It stays at zero while the
+    boards are in step.
+    """
+    def __init__(
+            self,
+            pipes,
+            buffer_samps: int,
+            board_chan_cnt: int = 2,
+            max_pad_samps: int = None,
+            samp_size: int = 4
+            ):
+        self.pipes = list(pipes)
+        self.buffer_samps = int(buffer_samps)
+        self.board_chan_cnt = int(board_chan_cnt)
+        self.frame = self.board_chan_cnt * 2
+        self.samp_size = int(samp_size)
+        self.dtype = FORMAT_DTYPE[format_from_samp_size(self.samp_size)]
+
+        if max_pad_samps is None:
+            max_pad_samps = self.buffer_samps * 4
+        self.max_pad_samps = int(max_pad_samps)
+
+        # Counters.
+        self.merged = 0
+        self.dropped = 0
+        self.padded = 0
+        self.resyncs = 0
+        self.skew = 0
+        self.max_skew = 0
+
+        # `[buf, frames, relative timestamp, used]` for each board.
+        self.heads = [None] * len(self.pipes)
+        self.bases = [None] * len(self.pipes)
+
+    def _advance(self, x: int) -> bool:
+        if self.heads[x] is not None:
+            buf, _, _, used = self.heads[x]
+            self.pipes[x].release(buf)
+            if not used:
+                self.dropped += 1
+
+        block = self.pipes[x].get()
+        if block is None:
+            return False
+
+        buf, timestamp, _ = block
+
+        if self.bases[x] is None:
+            self.bases[x] = timestamp
+
+        frames = np.frombuffer(buf, dtype=self.dtype).reshape(-1, self.frame)
+        self.heads[x] = [buf, frames, timestamp - self.bases[x], False]
+        return True
+
+    def _fill(self, x: int, start: int, dst):
+        """Copies the samples of board `x` for `[start, start + len(dst))`
+        into `dst`. Returns the number of samples that had to be padded or
+        `None` if the board stopped."""
+        samps = dst.shape[0]
+        filled = 0
+        padded = 0
+
+        while filled < samps:
+            _, frames, rel, _ = self.heads[x]
+            at = start + filled
+
+            if rel + frames.shape[0] <= at:
+                # Entirely in the past. The other boards have moved on.
+                if not self._advance(x):
+                    return None
+                continue
+
+            if rel > at:
+                # This board lost the samples before its head block.
+                n = min(rel - at, samps - filled)
+                dst[filled:filled + n] = 0
+                filled += n
+                padded += n
+                continue
+
+            off = at - rel
+            n = min(frames.shape[0] - off, samps - filled)
+            dst[filled:filled + n] = frames[off:off + n]
+            self.heads[x][3] = True
+            filled += n
+
+        return padded
+
+    def blocks(self):
+        """Yields `(merged, timestamp, gap)`. `merged` is reused between
+        blocks. `gap` is the number of samples per channel in or right before
+        this block that are not real samples (zero padding or skipped time).
+        """
+        for x in range(len(self.pipes)):
+            if not self._advance(x):
+                return
+
+        samps = self.buffer_samps
+        board_cnt = len(self.pipes)
+        merged = np.empty(samps * board_cnt * self.frame, self.dtype)
+        merged3 = merged.reshape(samps, board_cnt, self.frame)
+
+        target = 0
+
+        while True:
+            # Move past the head blocks `_fill` used up so the fast path
+            # and the skew see the blocks that are current.
+            for x in range(board_cnt):
+                while self.heads[x][2] + self.heads[x][1].shape[0] <= target:
+                    if not self._advance(x):
+                        return
+
+            rels = [head[2] for head in self.heads]
+            self.skew = max(rels) - min(rels)
+            self.max_skew = max(self.max_skew, self.skew)
+
+            gap = 0
+
+            lead = min(rels)
+            if lead - target > self.max_pad_samps:
+                # Every board is far ahead. Skip the hole instead of sending
+                # a long run of zeros.
+                gap = lead - target
+                target = lead
+                self.resyncs += 1
+
+            exact = all(
+                head[2] == target and head[1].shape[0] == samps
+                for head in self.heads
+            )
+
+            if exact:
+                reinterleave_boards(
+                    [head[0] for head in self.heads],
+                    merged,
+                    self.board_chan_cnt,
+                    self.samp_size
+                )
+                # They are advanced at the top of the loop once this block
+                # is out.
+                for x in range(board_cnt):
+                    self.heads[x][3] = True
+            else:
+                for x in range(board_cnt):
+                    padded = self._fill(x, target, merged3[:, x, :])
+                    if padded is None:
+                        return
+                    self.padded += padded
+                    gap = max(gap, padded)
+
+            self.merged += 1
+            yield merged, target, gap
+            target += samps
+
+class MultiBoardCapture:
+    """Configures the clock chain and triggers for a list of boards and runs
+    one reader thread per board.
+
+    `blocks` yields `(merged, timestamp, gap)` where `merged` is an int16
+    (int8 for SC8_Q7) buffer of all the channels interleaved in board order (`AABBCCDD..`) and
+    `timestamp` is the hardware timestamp of the first sample relative to the
+    trigger. See `BlockAligner` for how the boards are kept in step.
+    """
+    def __init__(
+            self,
+            serials,
+            sps: int = 2000000,
+            frequency: int = 1090000000,
+            gain: int = 60,
+            buffer_samps: int = 16 * 1024 * 32,
+            queue_depth: int = 8,
+            samp_size: int = 4
+            ):
+        self.serials = list(serials)
+        self.sps = int(sps)
+        self.frequency = int(frequency)
+        self.gain = gain
+        self.buffer_samps = int(buffer_samps)
+        self.queue_depth = int(queue_depth)
+        self.samp_size = int(samp_size)
+        self.board_chan_cnt = 2
+        self.chan_cnt = self.board_chan_cnt * len(self.serials)
+
+        self.devs = []
+        self.triggers = []
+        self.pipes = []
+        self.threads = []
+        self.aligner = None
+
+    @property
+    def format(self):
+        if self.samp_size == 2:
+            return bladerf._bladerf.Format.SC8_Q7_META
+        return bladerf._bladerf.Format.SC16_Q11_META
+
+    def configure(self):
+        for serial in self.serials:
+            print('opening', serial)
+            self.devs.append(BladeRFAndNumpy(f'libusb:serial={serial}'))
+
+        # Each board feeds its clock to the next one in the chain.
+        print('connecting clocks')
+        for dev in self.devs[:-1]:
+            dev.set_clock_output(True)
+        time.sleep(0.5)
+        for dev in self.devs[1:]:
+            dev.set_clock_select(bladerf._bladerf.ClockSelect.External)
+
+        print('creating triggers')
+        for x, dev in enumerate(self.devs):
+            trig = dev.trigger_init(0, bladerf._bladerf.TriggerSignal.Trigger_J51_1)
+            if x == 0:
+                trig.role = bladerf._bladerf.TRIGGER_ROLE_MASTER
+            else:
+                trig.role = bladerf._bladerf.TRIGGER_ROLE_SLAVE
+            self.triggers.append(trig)
+
+        for dev, trig in zip(self.devs, self.triggers):
+            dev.trigger_arm(trig, 1, 0, 0)
+
+        for dev in self.devs:
+            print('configuring', dev)
+            dev.sync_config(
+                bladerf._bladerf.ChannelLayout.RX_X2,
+                self.format,
+                num_buffers=16,
+                buffer_size=1024 * 32,
+                num_transfers=8,
+                stream_timeout=40000
+            )
+
+            for ch in [0, 2]:
+                dev.set_gain_mode(ch, bladerf._bladerf.GainMode.Manual)
+                dev.set_bias_tee(ch, False)
+                dev.set_bandwidth(ch, self.sps)
+                dev.set_sample_rate(ch, self.sps)
+                dev.set_gain(ch, self.gain)
+                dev.enable_module(ch, True)
+            print('setting frequency')
+            dev.set_frequency(0, self.frequency)
+
+    def start(self):
+        """Starts one reader thread per board and fires the trigger."""
+        for dev in self.devs:
+            pipe = CapturePipeline(
+                dev.stream_block_bytes(self.buffer_samps, self.board_chan_cnt, self.samp_size),
+                depth=self.queue_depth
+            )
+            # The trigger starts every board at the same instant so there is
+            # nothing stale to throw away.
+            stream = dev.sample_stream(
+                self.buffer_samps,
+                self.board_chan_cnt,
+                self.samp_size,
+                trash_samps=0,
+                next_slot=pipe.acquire
+            )
+            thread = threading.Thread(
+                target=pipe.capture, args=(stream,), daemon=True
+            )
+            thread.start()
+            self.pipes.append(pipe)
+            self.threads.append(thread)
+
+        time.sleep(1)
+        self.devs[0].trigger_fire(self.triggers[0])
+        print('trigger fired')
+
+    def close(self):
+        for pipe in self.pipes:
+            pipe.close()
+        for thread in self.threads:
+            thread.join()
+
+    def blocks(self):
+        """Yields `(merged, timestamp, gap)` as `BlockAligner.blocks` does."""
+        self.aligner = BlockAligner(
+            self.pipes,
+            self.buffer_samps,
+            self.board_chan_cnt,
+            samp_size=self.samp_size
+        )
+        return self.aligner.blocks()
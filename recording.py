@@ -0,0 +1,193 @@
+'''
+The recording format for raw IQ captures and a memory-mapped reader for it.
+
+A recording is a fixed 64 byte header followed by interleaved samples exactly
+as they come off the boards (`AABBCCDD..` / `IQIQIQIQ..`). The header is:
+
+    4s   magic `RSAR`
+    u8   version
+    u8   channel count
+    u8   sample format (FORMAT_SC16_Q11 or FORMAT_SC8_Q7)
+    u8   reserved
+    u32  sample rate
+    u64  centre frequency in Hz
+    u64  hardware timestamp of the first sample
+
+and is padded with zeros to `RECORDING_HEADER_BYTES` so the samples start
+aligned. Everything is little endian.
+
+Older captures such as `samples.bin` have no header. `Recording` still reads
+those if it is told the channel count.
+'''
+import struct
+import numpy as np
+from sampleformat import (
+    FORMAT_SC16_Q11, FORMAT_SAMP_SIZE, FORMAT_DTYPE, FORMAT_SCALE
+)
+
+RECORDING_MAGIC = b'RSAR'
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct('<4sBBBBIQQ')
+RECORDING_HEADER_BYTES = 64
+# The most zeros written at once when filling a skipped span.
+RECORDING_FILL_BYTES = 1 << 20
+
+class RecordingWriter:
+    """Writes a recording. The header is written with the first block
+    because that is when the start timestamp is known.
+
+    Every sample is kept at its place in time. If the timestamp of a block
+    is past the end of the last one the samples in between were skipped
+    and zeros are written for them, so the index of a sample in the file is
+    always its timestamp less the start timestamp.
+
+    An existing file at `path` is an error unless `overwrite` is set.
+    """
+    def __init__(
+            self,
+            path: str,
+            chan_cnt: int,
+            sample_rate: int,
+            frequency: int,
+            sample_format: int = FORMAT_SC16_Q11,
+            overwrite: bool = False
+            ):
+        self.chan_cnt = int(chan_cnt)
+        self.sample_rate = int(sample_rate)
+        self.frequency = int(frequency)
+        self.sample_format = int(sample_format)
+        self.frame_bytes = self.chan_cnt * FORMAT_SAMP_SIZE[self.sample_format]
+        # An existing capture is only replaced when asked to.
+        try:
+            self.fd = open(path, 'wb' if overwrite else 'xb')
+        except FileExistsError:
+            raise Exception(f'{path} already exists, pass overwrite to replace it')
+        self.started = False
+        # The timestamp of the sample after the last one written.
+        self.next = None
+
+        # Counters.
+        self.skipped = 0
+
+    def write(self, buf, timestamp: int = 0):
+        """Writes the block `buf` whose first sample has the hardware
+        `timestamp`."""
+        timestamp = int(timestamp)
+        if not self.started:
+            hdr = RECORDING_HEADER.pack(
+                RECORDING_MAGIC,
+                RECORDING_VERSION,
+                self.chan_cnt,
+                self.sample_format,
+                0,
+                self.sample_rate,
+                self.frequency,
+                timestamp
+            )
+            self.fd.write(hdr.ljust(RECORDING_HEADER_BYTES, b'\0'))
+            self.started = True
+            self.next = timestamp
+
+        if timestamp < self.next:
+            raise Exception(f'block at {timestamp} overlaps the recording which is at {self.next}')
+
+        if timestamp > self.next:
+            fill = (timestamp - self.next) * self.frame_bytes
+            zeros = bytes(min(fill, RECORDING_FILL_BYTES))
+            while fill > 0:
+                n = min(fill, len(zeros))
+                self.fd.write(zeros[:n])
+                fill -= n
+            self.skipped += timestamp - self.next
+
+        buf = memoryview(buf)
+        self.fd.write(buf)
+        self.next = timestamp + buf.nbytes // self.frame_bytes
+
+    def close(self):
+        self.fd.close()
+
+class Recording:
+    """Memory maps a recording.
+
+    `window` hands out `(channels, samples, 2)` views of the raw integers
+    without copying anything. `complex` scales a window into a
+    `(channels, samples)` complex array. Only the pages a window touches are
+    ever read from disk.
+
+    For a file without a header pass `chan_cnt` and, if they are not the
+    defaults, the sample format and rate.
+    """
+    def __init__(
+            self,
+            path: str,
+            chan_cnt: int = None,
+            sample_format: int = FORMAT_SC16_Q11,
+            sample_rate: int = 2000000,
+            frequency: int = 1090000000
+            ):
+        with open(path, 'rb') as fd:
+            hdr = fd.read(RECORDING_HEADER_BYTES)
+
+        if hdr[:len(RECORDING_MAGIC)] == RECORDING_MAGIC:
+            (
+                _, version, chan_cnt, sample_format, _,
+                sample_rate, frequency, timestamp
+            ) = RECORDING_HEADER.unpack(hdr[:RECORDING_HEADER.size])
+            if version != RECORDING_VERSION:
+                raise Exception(f'unsupported recording version {version}')
+            offset = RECORDING_HEADER_BYTES
+        else:
+            if chan_cnt is None:
+                raise Exception('the recording has no header so the channel count must be given')
+            timestamp = 0
+            offset = 0
+
+        self.chan_cnt = int(chan_cnt)
+        self.sample_format = int(sample_format)
+        self.sample_rate = int(sample_rate)
+        self.frequency = int(frequency)
+        self.timestamp = int(timestamp)
+        self.scale = FORMAT_SCALE[self.sample_format]
+
+        dtype = np.dtype(FORMAT_DTYPE[self.sample_format])
+        data = np.memmap(path, dtype=dtype, mode='r', offset=offset)
+        # A capture cut short may end in a partial sample.
+        frame = self.chan_cnt * 2
+        samps = data.shape[0] // frame
+        self.raw = data[:samps * frame].reshape(samps, self.chan_cnt, 2)
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+    def window(self, start: int, count: int):
+        """Returns a `(channels, samples, 2)` view of the raw I and Q
+        integers for `[start, start + count)`."""
+        start = int(start)
+        count = int(count)
+        return self.raw[start:start + count].transpose(1, 0, 2)
+
+    def complex(self, start: int, count: int, out=None, dtype=np.complex64):
+        """Returns the window as a `(channels, samples)` complex array scaled
+        to [-1, 1]. `out` may be given to avoid an allocation."""
+        raw = self.window(start, count)
+        if out is None:
+            out = np.empty(raw.shape[:2], dtype)
+        else:
+            out = out[:, :raw.shape[1]]
+        np.multiply(
+            raw,
+            1.0 / self.scale,
+            out=out.view(out.real.dtype).reshape(raw.shape),
+            casting='unsafe'
+        )
+        return out
+
+    def windows(self, count: int, step: int = None, dtype=np.complex64):
+        """Yields `(start, samples)` for consecutive windows of `count`
+        samples. The last window may be short. The array is reused."""
+        count = int(count)
+        step = count if step is None else int(step)
+        out = np.empty((self.chan_cnt, count), dtype)
+        for start in range(0, len(self), step):
+            yield start, self.complex(start, count, out)
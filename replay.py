@@ -0,0 +1,127 @@
+'''
+Serves a recording (see recording.py) on port 7878 exactly like `bladesdr.py`
+serves live samples, so `main.rs` and the other consumers can run without a
+radio.
+
+Every client that connects gets its own replay from the start of the file.
+`--rate 1` paces the samples in real time, `--rate 4` four times faster, and
+`--rate 0` sends as fast as the client reads. The achieved rate is printed as
+a multiple of real time, which is the real maximum throughput of the consumer
+when `--rate 0` is used.
+'''
+import time
+import socket
+import argparse
+import threading
+from recording import Recording
+from framing import FrameWriter
+from sampleformat import FORMAT_SC16_Q11, FORMAT_SC8_Q7, STREAM_SC8_FLAG
+
+def replay(connection, rec, args):
+    """Sends the recording to one client. Returns the number of samples per
+    channel sent."""
+    if args.framed:
+        writer = FrameWriter(rec.chan_cnt, rec.sample_rate, rec.sample_format)
+        handshake = bytes([0])
+    else:
+        writer = None
+        if rec.sample_format == FORMAT_SC8_Q7:
+            handshake = bytes([rec.chan_cnt | STREAM_SC8_FLAG])
+        else:
+            handshake = bytes([rec.chan_cnt])
+
+    connection.sendall(handshake)
+
+    block_samps = args.block_samps
+    sent = 0
+    st = time.time()
+    stat_start = st
+    # Keeps the timestamps increasing when the file loops.
+    base = rec.timestamp
+
+    while True:
+        for start in range(0, len(rec), block_samps):
+            # The memory map is contiguous per block so it goes straight to
+            # the socket without a copy.
+            block = memoryview(rec.raw[start:start + block_samps]).cast('B')
+
+            if writer is not None:
+                connection.sendall(
+                    writer.header(len(block), base + start)
+                )
+            connection.sendall(block)
+
+            sent += block.nbytes // (rec.chan_cnt * 2 * rec.raw.itemsize)
+
+            if args.rate > 0:
+                ahead = st + sent / (rec.sample_rate * args.rate) - time.time()
+                if ahead > 0:
+                    time.sleep(ahead)
+
+            if time.time() - stat_start > 5:
+                stat_start = time.time()
+                print(
+                    'sent', sent / rec.sample_rate, 'seconds',
+                    'at', sent / rec.sample_rate / (stat_start - st), 'x real time'
+                )
+
+        if not args.loop:
+            return sent
+        base += len(rec)
+
+def serve(connection, client, rec, args):
+    print('client', client, 'connected')
+    st = time.time()
+    try:
+        sent = replay(connection, rec, args)
+    except OSError:
+        print('client', client, 'disconnected')
+        return
+    finally:
+        connection.close()
+    et = time.time() - st
+    print(
+        'client', client, 'done',
+        'seconds', et,
+        'rate', sent / rec.sample_rate / et, 'x real time'
+    )
+
+def main(args):
+    sample_format = FORMAT_SC8_Q7 if args.sc8 else FORMAT_SC16_Q11
+
+    # The channel count and format only matter for files without a header.
+    rec = Recording(
+        args.file,
+        chan_cnt=args.chan_cnt,
+        sample_format=sample_format
+    )
+
+    print(
+        'replaying', len(rec) / rec.sample_rate, 'seconds of',
+        rec.chan_cnt, 'streams at', rec.frequency
+    )
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('localhost', args.port))
+    server.listen(8)
+
+    while True:
+        connection, client = server.accept()
+        threading.Thread(
+            target=serve, args=(connection, client, rec, args), daemon=True
+        ).start()
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(
+        description='Serves a recorded capture to all connected clients as if it were live.'
+    )
+    ap.add_argument('--file', type=str, required=True, help='The recording to serve.')
+    ap.add_argument('--rate', type=float, default=1.0, help='The speed as a multiple of real time. Zero sends as fast as the client reads.')
+    ap.add_argument('--loop', action='store_true', help='Start over at the end of the file instead of closing the connection.')
+    ap.add_argument('--block-samps', type=int, default=16 * 1024 * 32, help='The number of samples per channel sent at once.')
+    ap.add_argument('--port', type=int, default=7878, help='The port to serve on.')
+    ap.add_argument('--framed', action='store_true', help='Send the framed stream (see framing.py) instead of the raw stream that main.rs reads.')
+    ap.add_argument('--chan-cnt', type=int, default=None, help='The number of streams in a recording without a header.')
+    ap.add_argument('--sc8', action='store_true', help='The samples of a recording without a header are 8-bit SC8_Q7.')
+    main(ap.parse_args())
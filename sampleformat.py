@@ -0,0 +1,38 @@
+'''
+The sample formats that travel from the cards to the consumers.
+
+SC16_Q11 carries 12-bit I and Q values in int16 and SC8_Q7 carries I and Q in
+int8. SC8_Q7 halves the bytes per sample on USB, on TCP, and on disk.
+'''
+import numpy as np
+
+FORMAT_SC16_Q11 = 0
+FORMAT_SC8_Q7 = 1
+
+# Bytes per complex sample per channel.
+FORMAT_SAMP_SIZE = {
+    FORMAT_SC16_Q11: 4,
+    FORMAT_SC8_Q7: 2,
+}
+
+# The type holding one I or Q value.
+FORMAT_DTYPE = {
+    FORMAT_SC16_Q11: np.int16,
+    FORMAT_SC8_Q7: np.int8,
+}
+
+# Divide by this to scale the values into [-1, 1). The samples from the
+# blade are only 12-bit in SC16_Q11.
+FORMAT_SCALE = {
+    FORMAT_SC16_Q11: 2049.0,
+    FORMAT_SC8_Q7: 128.0,
+}
+
+# Set in the stream count byte of the raw 7878 stream when it carries SC8_Q7.
+STREAM_SC8_FLAG = 0x80
+
+def format_from_samp_size(samp_size: int) -> int:
+    for fmt, size in FORMAT_SAMP_SIZE.items():
+        if size == int(samp_size):
+            return fmt
+    raise Exception('unexpected sample size')
@@ -0,0 +1,219 @@
+'''
+Moves sample blocks from the thread that owns `sync_rx` to the thread that
+owns the socket. The blocks are preallocated and bounded in number so a slow
+consumer costs dropped (and counted) blocks instead of stalling the USB read
+and overrunning the buffers inside libbladeRF.
+
+`FanoutServer` then serves each captured block to any number of clients.
+'''
+import queue
+import socket
+import threading
+
+class PipelineClosed(Exception):
+    """Raised inside the capture thread when the pipeline is closed while it
+    is waiting for a free block."""
+    pass
+
+class CapturePipeline:
+    """A bounded producer/consumer pipeline of preallocated sample blocks.
+
+    The capture thread runs `capture` with a stream that takes its slots from
+    `acquire`. The sending thread calls `get` and hands each block back with
+    `release` once it has been sent.
+    """
+    def __init__(self, block_bytes: int, depth: int = 8):
+        self.free = queue.Queue()
+        self.full = queue.Queue()
+
+        for _ in range(int(depth)):
+            self.free.put(bytearray(int(block_bytes)))
+
+        self.stop = threading.Event()
+
+        # Counters. They are only written by the capture thread.
+        self.captured = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def acquire(self) -> bytearray:
+        """Returns an empty block for the capture thread.
+
+        If the sender has fallen behind and no block is free the oldest block
+        that has not been sent yet is dropped and reused. The capture thread
+        only waits when every block is in the hands of the sender.
+        """
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            buf, _, _ = self.full.get_nowait()
+            self.dropped += 1
+            return buf.obj
+        except queue.Empty:
+            pass
+
+        while not self.stop.is_set():
+            try:
+                return self.free.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+        raise PipelineClosed()
+
+    def capture(self, blocks):
+        """The capture thread target. `blocks` yields `(buf, timestamp, gap)`
+        like `BladeRFAndNumpy.sample_stream` does when given `acquire`."""
+        try:
+            for block in blocks:
+                if self.stop.is_set():
+                    break
+                self.full.put(block)
+                self.captured += 1
+                self.max_depth = max(self.max_depth, self.full.qsize())
+        except PipelineClosed:
+            pass
+        finally:
+            # Tell the sender that nothing else is coming.
+            self.full.put(None)
+
+    def get(self):
+        """Returns the next `(buf, timestamp, gap)` block or `None` once the
+        capture thread has stopped."""
+        return self.full.get()
+
+    def release(self, buf: memoryview):
+        self.free.put(buf.obj)
+
+    def depth(self) -> int:
+        return self.full.qsize()
+
+    def close(self):
+        self.stop.set()
+
+class Subscriber:
+    """One connected client of a `FanoutServer` with its own bounded send
+    queue and sending thread."""
+    def __init__(self, connection, client, depth: int, policy: str):
+        self.connection = connection
+        self.client = client
+        self.depth = int(depth)
+        self.policy = policy
+        self.queue = queue.Queue()
+        self.closed = threading.Event()
+        self.sent = 0
+        self.dropped = 0
+
+    def offer(self, block: bytes):
+        """Queues a block without ever blocking the caller."""
+        if self.closed.is_set():
+            return
+
+        if self.queue.qsize() >= self.depth:
+            if self.policy == 'disconnect':
+                print('disconnecting slow client', self.client)
+                self.close()
+                return
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+        self.queue.put(block)
+
+    def run(self, header: bytes):
+        """The sending thread target."""
+        try:
+            self.connection.sendall(header)
+            while not self.closed.is_set():
+                try:
+                    block = self.queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                self.connection.sendall(block)
+                self.sent += 1
+        except OSError as e:
+            print('client', self.client, 'went away:', e)
+        finally:
+            self.close()
+
+    def close(self):
+        self.closed.set()
+        try:
+            self.connection.close()
+        except OSError:
+            pass
+
+class FanoutServer:
+    """Serves the same sample blocks to any number of clients.
+
+    Every client first receives `header` (the one byte stream count that
+    `main.rs` expects) and then the blocks published after it connected. A
+    client that falls more than `depth` blocks behind either loses its oldest
+    queued block (`policy='drop-oldest'`) or is disconnected
+    (`policy='disconnect'`). In both cases the capture loop is never held up.
+    """
+    def __init__(
+            self,
+            address,
+            header: bytes,
+            depth: int = 8,
+            policy: str = 'drop-oldest'
+            ):
+        if policy not in ('drop-oldest', 'disconnect'):
+            raise Exception('unexpected slow client policy')
+
+        self.header = bytes(header)
+        self.depth = int(depth)
+        self.policy = policy
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp_socket.bind(address)
+        self.tcp_socket.listen(8)
+
+        self.accept_thread = threading.Thread(
+            target=self._accept, daemon=True
+        )
+        self.accept_thread.start()
+
+    def _accept(self):
+        while True:
+            connection, client = self.tcp_socket.accept()
+            print('got client', client)
+            sub = Subscriber(connection, client, self.depth, self.policy)
+            with self.lock:
+                self.subscribers.append(sub)
+            threading.Thread(
+                target=sub.run, args=(self.header,), daemon=True
+            ).start()
+
+    def publish(self, buf, prefix: bytes = b''):
+        """Hands `prefix` and `buf` to every client as one block. The block is
+        copied once so the caller may reuse `buf` as soon as this returns."""
+        with self.lock:
+            self.subscribers = [
+                sub for sub in self.subscribers if not sub.closed.is_set()
+            ]
+            subscribers = list(self.subscribers)
+
+        if len(subscribers) == 0:
+            return
+
+        block = b''.join((prefix, buf))
+
+        for sub in subscribers:
+            sub.offer(block)
+
+    def stats(self):
+        """Returns `(client, queued, sent, dropped)` for each client."""
+        with self.lock:
+            return [
+                (sub.client, sub.queue.qsize(), sub.sent, sub.dropped)
+                for sub in self.subscribers
+            ]
@@ -232,6 +232,16 @@ fn main() {
             // Read the number of streams.
             let streams = match stream.read(&mut short_buffer[0..1]) {
                 Ok(bytes_read) if bytes_read > 0 => {
+                    // The high bit marks 8-bit (SC8_Q7) samples which are not
+                    // supported here. The frontend has to run without `--sc8`.
+                    if short_buffer[0] & 0x80 != 0 {
+                        panic!("Sample stream carries 8-bit samples. Restart the frontend without --sc8.");
+                    }
+                    // A zero is the start of the framed stream (see framing.py)
+                    // which is not supported here either.
+                    if short_buffer[0] == 0 {
+                        panic!("Sample stream is framed. Restart the frontend without --framed.");
+                    }
                     short_buffer[0] as usize
                 },
                 Ok(_) => {
@@ -0,0 +1,269 @@
+'''
+Beam search strategies.
+
+A strategy hands out the weight rows to try on each block. Any object with a
+`name` and a `weights(X, rng)` method will do. `weights` returns a
+`(beams, channels)` batch for the `(channels, samples)` block `X` and draws
+anything random from `rng`, a `numpy.random.Generator`, so a run started
+from the same seed gives the same beams and the same counts.
+
+The random strategies draw fresh beams every block. `GoldenSweep` walks a
+low-discrepancy sequence over the phases instead, so its beams fill the
+phase space evenly and it needs fewer of them for the same coverage. The
+ULA grid and MVDR steer to a fixed set of angles. LMS is the odd one out: it
+trains one beam per offset, which `LmsStrategy.offsets` gives, and those are
+applied with `apply_per_offset` rather than a `BeamBank`.
+
+`AdaptiveStrategy` wraps a random or sweep strategy and sizes it each block
+with `BeamBudget` so the processing keeps to a fraction of the time the
+radio takes to fill a block. The beams that found messages recently are
+tracked and always tried first. `AdaptiveStrategy.run` is the whole loop
+for one block and is what the battle scripts and bench.py call.
+'''
+import time
+import numpy as np
+from beamform import (
+    BeamBank, MvdrScanner, random_weights, random_amp_weights, ula_steering,
+    ula_weights, lms_train
+)
+from modes import MODES_FRAME_SAMPLES
+
+# The seed of the random beams. The same seed gives the same counts.
+SEED = 0
+
+# The share of the time the radio takes to fill a block that an adaptive
+# search may spend on it. Its beam count follows from that.
+BUDGET_TARGET = 0.8
+
+class RandomStrategy:
+    """`beams` beams at uniformly random phases every block."""
+    name = 'random'
+
+    def __init__(self, beams: int):
+        self.beams = int(beams)
+
+    def weights(self, X, rng):
+        return random_weights(self.beams, X.shape[0], rng)
+
+class RandomAmpStrategy(RandomStrategy):
+    """Like `RandomStrategy` but with random amplitudes too."""
+    name = 'random-amp'
+
+    def weights(self, X, rng):
+        return random_amp_weights(self.beams, X.shape[0], rng)
+
+def golden_ratios(dims: int):
+    """The `dims` step sizes of the generalized golden ratio sequence, which
+    for one dimension is the golden angle."""
+    # `phi` is the positive root of `x ** (dims + 1) = x + 1`.
+    phi = 2.0
+    for _ in range(64):
+        phi = (1.0 + phi) ** (1.0 / (dims + 1))
+    return (1.0 / phi) ** np.arange(1, dims + 1)
+
+class GoldenSweep:
+    """`beams` beams a block from the generalized golden ratio sequence over
+    the phases of every channel after the first.
+
+    The sequence carries on from block to block so over time it covers the
+    phases evenly. The start is shifted by a random offset from `rng` on
+    the first block.
+    """
+    name = 'golden'
+
+    def __init__(self, beams: int):
+        self.beams = int(beams)
+        self.chan_cnt = None
+
+    def weights(self, X, rng):
+        chan_cnt = X.shape[0]
+        if chan_cnt != self.chan_cnt:
+            self.chan_cnt = chan_cnt
+            self.alpha = golden_ratios(chan_cnt - 1)
+            self.offset = rng.random(chan_cnt - 1)
+            self.n = 0
+
+        n = np.arange(self.n, self.n + self.beams)[:, None]
+        self.n += self.beams
+        u = np.mod(self.offset + n * self.alpha, 1.0)
+
+        w = np.ones((self.beams, chan_cnt), np.complex64)
+        w[:, 1:] = np.exp(2j * np.pi * u)
+        return w
+
+class UlaGridStrategy:
+    """A uniform linear array steered to each of `thetas`. The same beams
+    every block."""
+    name = 'ula'
+
+    def __init__(self, thetas, spacing: float):
+        self.thetas = np.asarray(thetas)
+        self.spacing = spacing
+
+    def weights(self, X, rng):
+        return ula_weights(self.thetas, X.shape[0], self.spacing)
+
+class MvdrStrategy:
+    """MVDR beams for a uniform linear array steered to each of `thetas`,
+    solved from the covariance of each block (see `MvdrScanner`)."""
+    name = 'mvdr'
+
+    def __init__(self, thetas, spacing: float, forget: float = None):
+        self.thetas = np.asarray(thetas)
+        self.spacing = spacing
+        self.forget = forget
+        self.scanner = None
+
+    def weights(self, X, rng):
+        if self.scanner is None or self.scanner.steering.shape[1] != X.shape[0]:
+            steering = ula_steering(self.thetas, X.shape[0], self.spacing)
+            self.scanner = MvdrScanner(steering, self.forget)
+        return self.scanner.update(X).weights()
+
+class LmsStrategy:
+    """One LMS beam per offset of the block trained on the `training`
+    samples. The rows are for `offsets`, which is every offset with a whole
+    frame after it, and they only apply to the samples past the training."""
+    name = 'lms'
+
+    def __init__(self, training, mu: float):
+        self.training = np.asarray(training)
+        self.mu = mu
+        self.offsets = np.zeros(0, np.intp)
+
+    def weights(self, X, rng):
+        self.offsets = np.arange(max(X.shape[1] - MODES_FRAME_SAMPLES, 0))
+        return lms_train(X, self.offsets, self.training, self.mu)
+
+class BeamBudget:
+    """The number of beams to try per block so a block takes `target` of
+    its `block_seconds` to process.
+
+    `update` is told how long each block took. The beam count is scaled by
+    the ratio of the target to that time, limited to halving or doubling
+    per block and damped by `gain` so noise in the timing does not make it
+    swing. The part of the cost that does not grow with the beams is taken
+    care of by the feedback.
+    """
+    def __init__(
+            self,
+            block_seconds: float,
+            target: float = BUDGET_TARGET,
+            beams: int = 600,
+            min_beams: int = 16,
+            max_beams: int = 4096,
+            gain: float = 0.5
+            ):
+        self.block_seconds = block_seconds
+        self.target = target
+        self.min_beams = int(min_beams)
+        self.max_beams = int(max_beams)
+        self.gain = gain
+        self.beams = min(max(int(beams), self.min_beams), self.max_beams)
+
+    def update(self, seconds: float):
+        """Returns the beam count for the next block after one that took
+        `seconds`."""
+        if seconds > 0:
+            ratio = min(max(self.target * self.block_seconds / seconds, 0.5), 2.0)
+            beams = int(round(self.beams * ratio ** self.gain))
+            self.beams = min(max(beams, self.min_beams), self.max_beams)
+        return self.beams
+
+class AdaptiveStrategy:
+    """The tracked beams then as many beams of `search` as `budget` leaves.
+
+    `search` must have a `beams` count, like `RandomStrategy` and
+    `GoldenSweep`. `run` does a whole block. It can also be driven by
+    hand: after each block `feedback` is given the rows of the
+    last weights that found messages, such as the beams `dedup_hits`
+    kept, and the time the block took. Those rows are tracked until they
+    have found nothing for `track_blocks` blocks. At most `max_tracked`
+    are kept, the stalest going first. The tracked beams are tried even
+    when they use up the whole budget.
+    """
+    name = 'adaptive'
+
+    def __init__(
+            self,
+            search,
+            budget: BeamBudget,
+            track_blocks: int = 8,
+            max_tracked: int = 64
+            ):
+        self.search = search
+        self.budget = budget
+        self.track_blocks = int(track_blocks)
+        self.max_tracked = int(max_tracked)
+        self.tracked = None
+        # The blocks since each tracked beam last found a message.
+        self.ages = np.zeros(0, np.intp)
+        self.last = None
+        # Kept across blocks for its scratch space.
+        self.bank = None
+
+    def weights(self, X, rng):
+        chan_cnt = X.shape[0]
+        if self.tracked is None or self.tracked.shape[1] != chan_cnt:
+            self.tracked = np.zeros((0, chan_cnt), np.complex64)
+            self.ages = np.zeros(0, np.intp)
+
+        self.search.beams = max(self.budget.beams - len(self.tracked), 0)
+        if self.search.beams > 0:
+            found = self.search.weights(X, rng)
+            self.last = np.concatenate([self.tracked, found.astype(np.complex64)])
+        else:
+            self.last = self.tracked
+        return self.last
+
+    def feedback(self, beams, seconds: float):
+        """Tracks the rows `beams` of the last weights and updates the
+        budget with the `seconds` the block took."""
+        beams = np.unique(np.asarray(beams, dtype=np.intp))
+        tracked_cnt = len(self.tracked)
+
+        self.ages += 1
+        self.ages[beams[beams < tracked_cnt]] = 0
+
+        new = beams[beams >= tracked_cnt]
+        tracked = np.concatenate([self.tracked, self.last[new]])
+        ages = np.concatenate([self.ages, np.zeros(len(new), np.intp)])
+
+        # The freshest first, so the stalest go over `max_tracked`.
+        keep = np.flatnonzero(ages < self.track_blocks)
+        keep = keep[np.argsort(ages[keep], kind='stable')][:self.max_tracked]
+        self.tracked = tracked[keep]
+        self.ages = ages[keep]
+
+        self.budget.update(seconds)
+
+    def run(self, X, rng, table, stages=None):
+        """Demodulates `X` with the next weights on a `BeamBank` and the
+        bit error `table`, then gives `feedback` the beams that found
+        messages and the time it all took. Returns what `BeamBank.demod`
+        does.
+
+        If `stages` is a dict the seconds making the weights are added to
+        its 'weights' and the rest as `BeamBank.demod` adds them.
+        """
+        st = time.perf_counter()
+        W = self.weights(X, rng)
+        if stages is not None:
+            stages['weights'] += time.perf_counter() - st
+
+        if self.bank is None:
+            self.bank = BeamBank(W)
+        else:
+            self.bank.set_weights(W)
+        hits = self.bank.demod(X, table, stages)
+
+        self.feedback(hits[0], time.perf_counter() - st)
+        return hits
+
+# The strategies by name.
+STRATEGIES = {
+    s.name: s for s in (
+        RandomStrategy, RandomAmpStrategy, GoldenSweep, UlaGridStrategy,
+        MvdrStrategy, LmsStrategy, AdaptiveStrategy
+    )
+}
@@ -3,6 +3,8 @@ This reads the output by the `main.rs` program.
 '''
 import struct
 import numpy as np
+from sampleformat import FORMAT_SC16_Q11, FORMAT_SCALE
+from modes import modes_checksum, load_error_table, fix_bit_errors
 import math
 import matplotlib.pyplot as plt
 import pickle
@@ -17,99 +19,6 @@ MODES_LONG_MSG_SAMPLES = MODES_LONG_MSG_BITS * 2
 MODES_SHORT_MSG_SAMPLES = MODES_SHORT_MSG_BITS * 2
 AIS_CHARSET = "?ABCDEFGHIJKLMNOPQRSTUVWXYZ????? ???????????????0123456789??????"
 
-MODES_CHECKSUM_TABLE = [
-    0x3935ea, 0x1c9af5, 0xf1b77e, 0x78dbbf, 0xc397db, 0x9e31e9, 0xb0e2f0, 0x587178,
-    0x2c38bc, 0x161c5e, 0x0b0e2f, 0xfa7d13, 0x82c48d, 0xbe9842, 0x5f4c21, 0xd05c14,
-    0x682e0a, 0x341705, 0xe5f186, 0x72f8c3, 0xc68665, 0x9cb936, 0x4e5c9b, 0xd8d449,
-    0x939020, 0x49c810, 0x24e408, 0x127204, 0x093902, 0x049c81, 0xfdb444, 0x7eda22,
-    0x3f6d11, 0xe04c8c, 0x702646, 0x381323, 0xe3f395, 0x8e03ce, 0x4701e7, 0xdc7af7,
-    0x91c77f, 0xb719bb, 0xa476d9, 0xadc168, 0x56e0b4, 0x2b705a, 0x15b82d, 0xf52612,
-    0x7a9309, 0xc2b380, 0x6159c0, 0x30ace0, 0x185670, 0x0c2b38, 0x06159c, 0x030ace,
-    0x018567, 0xff38b7, 0x80665f, 0xbfc92b, 0xa01e91, 0xaff54c, 0x57faa6, 0x2bfd53,
-    0xea04ad, 0x8af852, 0x457c29, 0xdd4410, 0x6ea208, 0x375104, 0x1ba882, 0x0dd441,
-    0xf91024, 0x7c8812, 0x3e4409, 0xe0d800, 0x706c00, 0x383600, 0x1c1b00, 0x0e0d80,
-    0x0706c0, 0x038360, 0x01c1b0, 0x00e0d8, 0x00706c, 0x003836, 0x001c1b, 0xfff409,
-    0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000,
-    0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000,
-    0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000, 0x000000
-]
-
-def modes_compute_crc(msg):
-    # len(msg) is either long or short (only two lengths possible)
-
-    bits = len(msg) * 8
-
-    assert len(msg) == MODES_LONG_MSG_BYTES or len(msg) == MODES_SHORT_MSG_BYTES
-
-    if bits == 112:
-        offset = 0
-    else:
-        offset = 112 - 56
-
-    crc = 0    
-
-    # subtract 24 so we don't process the CRC field
-    for j in range(bits - 24):
-        bytendx = int(j // 8)
-        bitndx = j % 8
-        bitmask = 1 << (7 - bitndx)
-
-        if msg[bytendx] & bitmask != 0:
-            crc = crc ^ MODES_CHECKSUM_TABLE[offset + j]
-
-    return crc & 0xffffff
-
-def modes_checksum(msg):
-    crc = modes_compute_crc(msg)
-    rem = (msg[-3] << 16) | (msg[-2] << 8) | msg[-1]
-    return (crc ^ rem) & 0xffffff
-
-def modes_init_error_info():
-    msg = [0] * MODES_LONG_MSG_BYTES
-
-    bit_error_table = {}
-
-    for i in range(5, MODES_LONG_MSG_BITS):
-        bytepos0 = i >> 3
-        mask0 = 1 << (7 - (i & 7))
-        msg[bytepos0] = msg[bytepos0] ^ mask0
-        crc = modes_checksum(msg)
-
-        bit_error_table[crc] =  (i,)
-
-        for j in range(i + 1, MODES_LONG_MSG_BITS):
-            bytepos1 = j >> 3
-            mask1 = 1 << (7 - (j & 7))
-            msg[bytepos1] = msg[bytepos1] ^ mask1
-            crc = modes_checksum(msg)
-
-            bit_error_table[crc] = (i, j)
-
-            msg[bytepos1] = msg[bytepos1] ^ mask1
-        msg[bytepos0] = msg[bytepos0] ^ mask0
-
-    return bit_error_table
-
-def fix_bit_errors(msg, bit_error_table):
-    syndrome = modes_checksum(msg)
-    pei = bit_error_table.get(syndrome, None)
-    
-    if pei is None:
-        return 0
-    
-    offset = MODES_LONG_MSG_BITS - len(msg) * 8
-
-    for _bitpos in pei:
-        bitpos = _bitpos - offset
-        if bitpos < 0:
-            return 0
-
-    for _bitpos in pei:
-        bitpos = _bitpos - offset
-        msg[bitpos >> 3] = msg[bitpos >> 3] ^ (1 << (7 - (bitpos & 7)))
-    
-    return len(pei)
-
 def bits_to_bytes(bits):
     thebyte = 0
     out = []
@@ -438,14 +347,14 @@ def main():
             
             byaddr[addr].append((ndx, msg, thetas))
 
-            ai = samples[0::8] / 2049.0
-            aq = samples[1::8] / 2049.0
-            bi = samples[2::8] / 2049.0
-            bq = samples[3::8] / 2049.0
-            ci = samples[4::8] / 2049.0
-            cq = samples[5::8] / 2049.0
-            di = samples[6::8] / 2049.0
-            dq = samples[7::8] / 2049.0
+            ai = samples[0::8] / FORMAT_SCALE[FORMAT_SC16_Q11]
+            aq = samples[1::8] / FORMAT_SCALE[FORMAT_SC16_Q11]
+            bi = samples[2::8] / FORMAT_SCALE[FORMAT_SC16_Q11]
+            bq = samples[3::8] / FORMAT_SCALE[FORMAT_SC16_Q11]
+            ci = samples[4::8] / FORMAT_SCALE[FORMAT_SC16_Q11]
+            cq = samples[5::8] / FORMAT_SCALE[FORMAT_SC16_Q11]
+            di = samples[6::8] / FORMAT_SCALE[FORMAT_SC16_Q11]
+            dq = samples[7::8] / FORMAT_SCALE[FORMAT_SC16_Q11]
             a = ai + 1j * aq
             b = bi + 1j * bq
             c = ci + 1j * cq
@@ -468,7 +377,7 @@ def main():
             
             q += 1
 
-    bit_error_table = modes_init_error_info()
+    bit_error_table = load_error_table()
     
     sps = 2e6
 